@@ -0,0 +1,219 @@
+"""
+图片MD5修改工具 - 准入控制
+网页版按解码后的像素数、版本数、处理引擎和编码配置估算每个任务（包括按需生成模式下载时生成的版本）的工作量，
+限制排队的工作总量和每个客户端的并发请求数，超出时拒绝新请求（返回429和Retry-After）；
+排队的任务按客户端轮流执行，一个客户端提交大量任务不会拖慢其他客户端
+"""
+
+import math
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image
+
+from image_md5_modifier import DEFAULT_ENCODER
+
+
+# 每百万像素的估计耗时（秒，单核）：解码一次原图；每个版本的修改方法（classic组合2-4种方法，batch批量添加噪声）
+DECODE_COST = 0.01
+METHOD_COST = {'classic': 0.06, 'batch': 0.02}
+# 每个版本每百万像素的编码耗时，按编码配置和格式（PNG的smallest配置要尝试多种压缩参数，最慢）
+ENCODE_COST = {
+    'fast': {'jpeg': 0.011, 'png': 0.14, 'gif': 0.45, 'other': 0.003},
+    'balanced': {'jpeg': 0.01, 'png': 0.74, 'gif': 0.54, 'other': 0.003},
+    'smallest': {'jpeg': 0.028, 'png': 3.6, 'gif': 0.43, 'other': 0.003},
+}
+# 每个任务的固定开销（读取、保存、调度）
+TASK_COST = 0.005
+
+# 建议的重试等待时间上限（秒）
+MAX_RETRY_AFTER = 60
+
+
+def _format_key(file_ext):
+    ext = file_ext.lower().lstrip('.')
+    if ext in ('jpg', 'jpeg'):
+        return 'jpeg'
+    return ext if ext in ('png', 'gif') else 'other'
+
+
+def estimate_cost(megapixels, num_versions, file_ext, engine='classic', encoder=DEFAULT_ENCODER):
+    """估计生成num_versions个版本的耗时（秒，单核）"""
+    per_version = METHOD_COST.get(engine, METHOD_COST['classic']) + ENCODE_COST[encoder][_format_key(file_ext)]
+    return TASK_COST + megapixels * (DECODE_COST + num_versions * per_version)
+
+
+def image_megapixels(file):
+    """只读取图片头部获得尺寸（不解码像素），返回百万像素数，读取后把文件位置恢复原处；无法识别时返回0"""
+    position = file.tell()
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    except Exception:
+        return 0.0  # 处理时会因无法打开图片而很快失败
+    finally:
+        file.seek(position)
+    return width * height / 1e6
+
+
+class Rejected(Exception):
+    """请求未被接受: status为HTTP状态码，retry_after为建议的重试等待秒数"""
+    
+    def __init__(self, message, reason, status=429, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    一个已接受请求的各个任务计入的工作量，每个任务完成（或不再需要处理）后调用done归还
+    
+    超出客户端限额的请求按比例缩小计入，scale为计入的工作量与估计值之比。
+    """
+    
+    def __init__(self, controller, client, costs, scale=1.0):
+        self.controller = controller
+        self.client = client
+        self.costs = list(costs)  # 已归还的任务为None
+        self.pending = len(self.costs)
+        self.scale = scale
+    
+    def done(self, index, seconds=None):
+        """归还第index个任务的工作量，seconds为实际耗时（用于校正重试等待时间）"""
+        self.controller._release(self, index, seconds)
+    
+    def cancel(self):
+        """归还所有尚未归还的任务（请求处理失败时）"""
+        for index in range(len(self.costs)):
+            self.done(index)
+
+
+class AdmissionController:
+    """
+    全局工作量预算和客户端限额
+    
+    budget为所有已接受但尚未完成的任务的估计耗时之和的上限（秒），每个客户端最多占用其中client_share，
+    同时最多有client_max_requests个请求在处理。单个请求超过客户端限额时，只在该客户端没有其他请求时接受，
+    按客户端限额计入（排队时按客户端轮流执行，不会拖慢其他客户端）；超出限额时返回429，
+    重试等待时间按超出的工作量除以workers估计，并按实际耗时与估计值之比校正。
+    """
+    
+    def __init__(self, budget, workers, client_max_requests=4, client_share=0.5):
+        self.budget = budget
+        self.workers = workers
+        self.client_max_requests = client_max_requests
+        self.client_budget = budget * client_share
+        self.lock = threading.Lock()
+        self.used = 0.0
+        self.clients = {}  # 客户端 -> {'requests': 处理中的请求数, 'cost': 未完成的工作量}
+        self.speed = 1.0  # 实际耗时 / 估计耗时（指数移动平均）
+        self.admitted = 0
+        self.rejected = 0
+    
+    def _retry_after(self, excess):
+        return min(MAX_RETRY_AFTER, max(1, math.ceil(excess * self.speed / self.workers)))
+    
+    def admit(self, client, costs):
+        """接受一个请求（costs为其中各个任务的估计工作量），返回Ticket；超出限额时抛出Rejected"""
+        costs = list(costs)
+        total = sum(costs)
+        scale = 1.0
+        with self.lock:
+            state = self.clients.get(client, {'requests': 0, 'cost': 0.0})
+            if total > self.client_budget and not state['requests']:
+                scale = self.client_budget / total
+                costs = [cost * scale for cost in costs]
+                total = self.client_budget
+            if state['requests'] >= self.client_max_requests:
+                reason, excess = 'client_requests', state['cost'] / state['requests']
+            elif state['cost'] + total > self.client_budget:
+                reason, excess = 'client_cost', state['cost'] + total - self.client_budget
+            elif self.used + total > self.budget:
+                reason, excess = 'budget', self.used + total - self.budget
+            else:
+                state['requests'] += 1
+                state['cost'] += total
+                self.clients[client] = state
+                self.used += total
+                self.admitted += 1
+                return Ticket(self, client, costs, scale)
+            self.rejected += 1
+            retry_after = self._retry_after(excess)
+        raise Rejected('服务器繁忙，请稍后再试', reason, retry_after=retry_after)
+    
+    def _release(self, ticket, index, seconds):
+        with self.lock:
+            cost = ticket.costs[index]
+            if cost is None:
+                return
+            ticket.costs[index] = None
+            ticket.pending -= 1
+            state = self.clients[ticket.client]
+            state['cost'] = max(0.0, state['cost'] - cost)
+            self.used = max(0.0, self.used - cost)
+            if ticket.pending == 0:
+                state['requests'] -= 1
+                if state['requests'] == 0:
+                    del self.clients[ticket.client]
+            if seconds is not None and cost > 0:
+                self.speed = 0.9 * self.speed + 0.1 * (seconds * ticket.scale / cost)
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'budget': self.budget,
+                'used': self.used,
+                'clients': len(self.clients),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'speed': self.speed,
+            }
+
+
+class FairExecutor:
+    """
+    按客户端轮流执行任务的线程池
+    
+    每个客户端的任务排在各自的队列中，空闲线程先从正在执行的任务最少的客户端取下一个任务（相同时轮流），
+    所以一个客户端排队的任务再多，其他客户端的新任务也只需等待当前的某个任务完成。
+    """
+    
+    def __init__(self, max_workers, thread_name_prefix=''):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.lock = threading.Lock()
+        self.queues = OrderedDict()  # 客户端 -> deque[(函数, 参数)]，按轮到的先后排列
+        self.running = {}  # 客户端 -> 正在执行的任务数
+    
+    def submit(self, client, fn, *args):
+        """把任务放入client的队列，返回Future（可等待任务完成并取得返回值）"""
+        future = Future()
+        with self.lock:
+            self.queues.setdefault(client, deque()).append((fn, args, future))
+        # 每个任务对应一次_run_next，但执行的是轮到的客户端的任务，不一定是这个任务
+        self.executor.submit(self._run_next)
+        return future
+    
+    def _run_next(self):
+        with self.lock:
+            client = min(self.queues, key=lambda c: self.running.get(c, 0))
+            queue = self.queues[client]
+            fn, args, future = queue.popleft()
+            if queue:
+                self.queues.move_to_end(client)
+            else:
+                del self.queues[client]
+            self.running[client] = self.running.get(client, 0) + 1
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            with self.lock:
+                self.running[client] -= 1
+                if not self.running[client]:
+                    del self.running[client]
@@ -3,22 +3,120 @@
 """
 
 import os
+import io
+import time
 import hashlib
 import uuid
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import secrets
+import zipfile
+import mimetypes
+import threading
+from PIL import Image
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, stream_with_context
 from werkzeug.utils import secure_filename
-from image_md5_modifier import process_image
+from admission import AdmissionController, FairExecutor, Rejected, estimate_cost, image_megapixels
+from image_md5_modifier import (DEFAULT_ENCODER, ENCODERS, StageProfile, generate_variant, iter_variants,
+                                open_source, recording)
+from md5_index import DEFAULT_INDEX_PATH, open_index
+from metrics import Registry
+from result_cache import ResultCache
+from session_store import DiskSessionStore, MemorySessionStore
 
 app = Flask(__name__, template_folder='templates')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'outputs'
-
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+app.config['CACHE_FOLDER'] = 'cache'
+# 结果缓存总大小上限，超出时按LRU淘汰
+app.config['CACHE_MAX_BYTES'] = int(os.environ.get('CACHE_MAX_MB', 1024)) * 1024 * 1024
+# 处理引擎，默认与命令行相同的classic（各版本随机组合修改方法）；batch只批量添加噪声，速度更快但修改方式不同
+app.config['ENGINE'] = os.environ.get('MD5_ENGINE', 'classic')
+# 分块处理的临时内存上限，逐像素的噪声按条带处理，设为0时整张图片一次处理
+app.config['TILE_MEMORY_BYTES'] = int(os.environ.get('TILE_MEMORY_MB', 64)) * 1024 * 1024 or None
+# 按需生成: 上传后不立即生成，每个版本在第一次下载时才单独生成（由随机种子和版本序号决定）
+app.config['LAZY_VERSIONS'] = os.environ.get('LAZY_VERSIONS', 'false').lower() == 'true'
+# 后台处理线程数和最多排队的任务数，超出时返回503
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', os.cpu_count() or 2))
+app.config['MAX_PENDING_JOBS'] = int(os.environ.get('MAX_PENDING_JOBS', 64))
+# 准入控制: 所有排队和处理中任务的估计耗时之和上限（秒，默认每个处理线程60秒），每个客户端最多占用其中的比例
+# 和同时处理的请求数，超出时返回429和Retry-After；客户端默认按IP区分，部署在反向代理之后时可指定请求头
+app.config['ADMISSION_BUDGET'] = float(os.environ.get('ADMISSION_BUDGET_SECONDS', 60 * app.config['JOB_WORKERS']))
+app.config['CLIENT_MAX_SHARE'] = float(os.environ.get('CLIENT_MAX_SHARE', 0.5))
+app.config['CLIENT_MAX_REQUESTS'] = int(os.environ.get('CLIENT_MAX_REQUESTS', 4))
+app.config['CLIENT_HEADER'] = os.environ.get('CLIENT_HEADER') or None
+# 输出存储: disk写入outputs和uploads目录，memory上传和生成的文件都只保存在内存中
+app.config['OUTPUT_STORE'] = os.environ.get('OUTPUT_STORE', 'disk')
+# 会话在最后一次访问后保留的时间，以及所有会话的总大小上限，超出时由后台线程删除最久未访问的会话
+app.config['SESSION_TTL'] = int(os.environ.get('SESSION_TTL_MINUTES', 60)) * 60
+app.config['SESSION_MAX_BYTES'] = int(os.environ.get(
+    'SESSION_MAX_MB', 512 if app.config['OUTPUT_STORE'] == 'memory' else 4096)) * 1024 * 1024
+# 全局MD5索引: 设置后所有会话（以及使用同一索引文件的命令行和图形界面）生成的MD5都不重复，
+# 设为default使用默认索引文件；启用后不使用结果缓存（缓存命中会重复使用之前生成的文件）
+app.config['MD5_INDEX'] = os.environ.get('MD5_INDEX') or None
+if app.config['MD5_INDEX'] == 'default':
+    app.config['MD5_INDEX'] = DEFAULT_INDEX_PATH
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
 
+# 打包下载时每次读取的字节数
+ZIP_CHUNK_SIZE = 64 * 1024
+
+# 缩略图最长边的像素数和JPEG质量
+THUMB_SIZE = 256
+THUMB_QUALITY = 80
+
+# 生成的文件内容不会再改变（文件名在会话中唯一），浏览器可缓存一年
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# 后台任务: session_id -> {'files': [每个文件的处理状态]}，由jobs_lock保护；排队的任务按客户端轮流执行
+executor = FairExecutor(app.config['JOB_WORKERS'])
+admission = AdmissionController(app.config['ADMISSION_BUDGET'], app.config['JOB_WORKERS'],
+                                app.config['CLIENT_MAX_REQUESTS'], app.config['CLIENT_MAX_SHARE'])
+jobs = {}
+jobs_lock = threading.Lock()
+
+# 按需生成的版本: session_id -> {'lock', 'md5s': 已生成的MD5, 'files': {输出文件名: (图片来源, 原文件名, 版本序号, 种子)}}
+lazy_versions = {}
+
+
+def forget_job(session_id):
+    """会话过期或被淘汰后删除其任务状态"""
+    with jobs_lock:
+        jobs.pop(session_id, None)
+        lazy_versions.pop(session_id, None)
+
+
+# 会话存储和相同图片、相同参数的处理结果缓存（基于硬链接，仅用于磁盘存储）
+result_cache = None
+md5_index = open_index(app.config['MD5_INDEX']) if app.config['MD5_INDEX'] else None
+if app.config['OUTPUT_STORE'] == 'memory':
+    session_store = MemorySessionStore(
+        app.config['SESSION_MAX_BYTES'], app.config['SESSION_TTL'], keep_uploads=app.config['LAZY_VERSIONS'],
+        on_evict=forget_job)
+else:
+    session_store = DiskSessionStore(
+        app.config['OUTPUT_FOLDER'], app.config['UPLOAD_FOLDER'],
+        app.config['SESSION_MAX_BYTES'], app.config['SESSION_TTL'], on_evict=forget_job)
+    if md5_index is None:
+        result_cache = ResultCache(app.config['CACHE_FOLDER'], app.config['CACHE_MAX_BYTES'])
+
+
+# 运行指标，由/metrics以Prometheus文本格式输出
+registry = Registry()
+REQUEST_SECONDS = registry.histogram('md5_http_request_seconds', 'HTTP请求耗时', ('endpoint', 'status'))
+JOB_SECONDS = registry.histogram('md5_job_seconds', '单个文件从开始处理到完成的耗时', ('status',))
+STAGE_SECONDS = registry.histogram('md5_stage_seconds', '单个文件在各处理阶段的耗时', ('stage',))
+JOBS = registry.counter('md5_jobs_total', '处理完成的文件数', ('status',))
+BYTES = registry.counter('md5_bytes_total', '读入的原图和生成的版本字节数', ('direction',))
+VERSIONS = registry.counter('md5_versions_total', '生成的版本数')
+RETRIES = registry.counter('md5_retries_total', 'MD5重复导致的重试次数')
+REJECTED = registry.counter('md5_rejected_total', '准入控制拒绝的请求数', ('reason',))
+registry.gauge('md5_queue_depth', '排队和处理中的文件数', lambda: pending_job_count())
+registry.gauge('md5_sessions', '会话存储中的会话数', lambda: session_store.stats()['sessions'])
+registry.gauge('md5_session_bytes', '会话存储占用的字节数', lambda: session_store.stats()['bytes'])
+registry.gauge('md5_admission_used_seconds', '已接受但尚未完成的任务的估计耗时', lambda: admission.stats()['used'])
+registry.gauge('md5_admission_budget_seconds', '准入控制的工作量预算', lambda: admission.budget)
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -32,6 +130,368 @@ def calculate_md5(file_path):
     return hash_md5.hexdigest()
 
 
+def parse_num_versions():
+    """读取表单中的生成数量，超出1-100时使用默认值3，不是整数时抛出ValueError"""
+    num_versions = int(request.form.get('num_versions', 3))
+    if num_versions < 1 or num_versions > 100:
+        num_versions = 3
+    return num_versions
+
+
+def parse_encoder():
+    encoder = request.form.get('encoder', DEFAULT_ENCODER)
+    return encoder if encoder in ENCODERS else DEFAULT_ENCODER
+
+
+def client_id():
+    """区分客户端: 默认为对方IP，配置了CLIENT_HEADER时取该请求头（例如X-Forwarded-For的第一项）"""
+    header = app.config['CLIENT_HEADER']
+    if header:
+        value = request.headers.get(header, '').split(',')[0].strip()
+        if value:
+            return value
+    return request.remote_addr
+
+
+def admit(client, files, num_versions, encoder):
+    """
+    估计每个上传文件的工作量并申请准入，返回Ticket；超出限额时抛出Rejected
+    
+    只读取图片头部获得尺寸，不保存文件。按需生成模式在下载时逐个生成版本，上传时不占用工作量，返回None
+    （下载时再为要生成的版本申请准入，见admit_lazy）。
+    """
+    if app.config['LAZY_VERSIONS']:
+        return None
+    costs = [estimate_cost(image_megapixels(file.stream), num_versions, os.path.splitext(file.filename)[1],
+                           app.config['ENGINE'], encoder) for file in files]
+    return admission.admit(client, costs)
+
+
+def rejection(error):
+    """准入控制拒绝请求时的响应，可重试时带Retry-After"""
+    REJECTED.inc(error.reason)
+    response = jsonify({'error': error.message, 'retry_after': error.retry_after})
+    response.status_code = error.status
+    if error.retry_after is not None:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def create_session():
+    """
+    在会话存储中登记新会话（使用UUID），返回(会话ID, 输出文件夹)
+    
+    磁盘存储为每个会话创建独立的输出和上传文件夹，避免排队中的同名文件被覆盖；
+    内存存储不创建文件夹，输出文件夹为None。新会话处于处理中状态，任务放入队列或请求失败后调用session_store.release。
+    """
+    session_id = str(uuid.uuid4())[:8]  # 使用UUID的前8位作为会话ID
+    output_dir, _ = session_store.create(session_id)
+    return session_id, output_dir
+
+
+def unique_filename(filename, taken):
+    """同一会话中出现同名文件时加上序号，避免输出文件互相覆盖"""
+    base_name, ext = os.path.splitext(filename)
+    candidate = filename
+    index = 2
+    while candidate in taken:
+        candidate = f"{base_name}_{index}{ext}"
+        index += 1
+    taken.add(candidate)
+    return candidate
+
+
+def update_job(session_id, index, **fields):
+    with jobs_lock:
+        jobs[session_id]['files'][index].update(fields)
+
+
+def pending_job_count():
+    with jobs_lock:
+        return sum(1 for job in jobs.values() for entry in job['files']
+                   if entry['status'] in ('queued', 'processing'))
+
+
+def job_summary(session_id):
+    """汇总会话中所有文件的处理进度，会话不存在时返回None"""
+    with jobs_lock:
+        job = jobs.get(session_id)
+        if job is None:
+            return None
+        files = [dict(entry, versions=list(entry.get('versions', ()))) for entry in job['files']]
+    
+    statuses = {entry['status'] for entry in files}
+    if statuses <= {'queued'}:
+        status = 'queued'
+    elif statuses & {'queued', 'processing'}:
+        status = 'processing'
+    elif 'done' in statuses:
+        status = 'done'
+    else:
+        status = 'error'
+    
+    summary = {
+        'session_id': session_id,
+        'status': status,
+        'filename': files[0]['filename'],
+        'completed': sum(entry['completed'] for entry in files),
+        'generated_count': sum(entry['generated_count'] for entry in files),
+        'total_files': sum(entry['total_files'] for entry in files),
+        'files': files,
+    }
+    if status == 'error':
+        summary['error'] = files[0].get('error', '处理失败')
+    return summary
+
+
+def queue_files(session_id, output_dir, uploads, num_versions, encoder=DEFAULT_ENCODER, client=None,
+                ticket=None):
+    """
+    登记会话中的文件并逐个放入client的后台队列，uploads为[(文件名, 上传路径或文件内容)]
+    
+    命中结果缓存的文件直接链接之前生成的版本，不再排队处理，立即归还ticket中该文件的工作量。
+    """
+    if app.config['LAZY_VERSIONS']:
+        register_lazy(session_id, uploads, num_versions, encoder)
+        return
+    
+    pending = []
+    with jobs_lock:
+        jobs[session_id] = {'files': []}
+    for index, (filename, source) in enumerate(uploads):
+        cache_key = None
+        cached = False
+        if result_cache is not None:
+            base_name, file_ext = os.path.splitext(filename)
+            original_md5 = calculate_md5(source)
+            cache_key = ResultCache.make_key(original_md5, file_ext, f"pixel-{app.config['ENGINE']}-{encoder}")
+            cached = result_cache.lookup(cache_key, num_versions, output_dir, base_name, file_ext)
+            if cached:
+                for i in range(num_versions):
+                    session_store.add(session_id, f"{base_name}_v{i + 1:02d}{file_ext}")
+        if cached:
+            JOBS.inc('cached')
+            if ticket is not None:
+                ticket.done(index)
+        with jobs_lock:
+            jobs[session_id]['files'].append({
+                'filename': filename,
+                'status': 'done' if cached else 'queued',
+                'completed': num_versions if cached else 0,
+                'generated_count': num_versions if cached else 0,
+                'total_files': num_versions,
+                'cached': cached,
+            })
+        if not cached:
+            pending.append((index, filename, source, cache_key))
+    
+    for index, filename, source, cache_key in pending:
+        session_store.acquire(session_id)
+        executor.submit(client, run_job, session_id, index, filename, source, output_dir, num_versions, cache_key,
+                        encoder, ticket)
+
+
+def register_lazy(session_id, uploads, num_versions, encoder=DEFAULT_ENCODER):
+    """按需生成模式: 只登记每个文件的各个版本及生成一个版本的估计工作量，任务直接标记为完成，下载时再生成"""
+    files = {}
+    entries = []
+    for filename, source in uploads:
+        base_name, file_ext = os.path.splitext(filename)
+        seed = secrets.randbits(32)
+        with open_source(source) as f:
+            cost = estimate_cost(image_megapixels(f), 1, file_ext, app.config['ENGINE'], encoder)
+        for i in range(num_versions):
+            files[f"{base_name}_v{i + 1:02d}{file_ext}"] = (source, filename, i, seed, encoder, cost)
+        entries.append({
+            'filename': filename,
+            'status': 'done',
+            'completed': num_versions,
+            'generated_count': num_versions,
+            'total_files': num_versions,
+            'cached': False,
+            'lazy': True,
+        })
+    with jobs_lock:
+        jobs[session_id] = {'files': entries}
+        lazy_versions[session_id] = {'lock': threading.Lock(), 'md5s': set(), 'files': files}
+
+
+def admit_lazy(session_id, filenames):
+    """
+    按需生成模式: 为filenames中尚未生成的版本申请准入，返回与filenames一一对应的Ticket（已生成的版本工作量为0）
+    
+    与上传一样计入工作总量和客户端限额，超出时抛出Rejected；没有需要生成的版本时返回None。
+    """
+    with jobs_lock:
+        lazy = lazy_versions.get(session_id)
+    if lazy is None:
+        return None
+    costs = [lazy['files'][filename][5]
+             if filename in lazy['files'] and session_store.get(session_id, filename) is None else 0.0
+             for filename in filenames]
+    if not any(costs):
+        return None
+    return admission.admit(client_id(), costs)
+
+
+def ensure_version(session_id, filename, ticket=None, index=0):
+    """
+    返回会话中文件的路径或内容；按需生成模式下尚未生成的版本在此单独生成
+    
+    生成任务放入ticket所属客户端的后台队列，与上传的任务一起按客户端轮流执行，完成后归还ticket中第index个任务的工作量。
+    """
+    source = session_store.get(session_id, filename)
+    if source is not None:
+        return source
+    with jobs_lock:
+        lazy = lazy_versions.get(session_id)
+    if lazy is None or filename not in lazy['files']:
+        return None
+    
+    with lazy['lock']:
+        source = session_store.get(session_id, filename)
+        if source is not None:
+            return source
+        client = ticket.client if ticket is not None else None
+        session_store.acquire(session_id)
+        try:
+            executor.submit(client, generate_lazy, session_id, filename, lazy, ticket, index).result()
+        finally:
+            session_store.release(session_id)
+    return session_store.get(session_id, filename)
+
+
+def generate_lazy(session_id, filename, lazy, ticket=None, index=0):
+    """后台线程: 生成按需生成模式的一个版本并存入会话，完成后归还ticket中第index个任务的工作量"""
+    upload, upload_name, version, seed, encoder, _ = lazy['files'][filename]
+    profile = StageProfile()
+    start = time.perf_counter()
+    result = None
+    try:
+        with recording(profile):
+            result = generate_variant(upload, version, seed, engine=app.config['ENGINE'], filename=upload_name,
+                                      generated_md5s=lazy['md5s'], max_tile_bytes=app.config['TILE_MEMORY_BYTES'],
+                                      encoder=encoder, md5_index=md5_index)
+        if result is not None:
+            session_store.put(session_id, filename, result[1], result[2])
+    finally:
+        seconds = time.perf_counter() - start
+        if ticket is not None:
+            ticket.done(index, seconds)
+        record_job(profile, 'lazy' if result is not None else 'error', seconds)
+
+
+def session_filenames(session_id):
+    """会话中所有文件名（包括按需生成模式下尚未生成的版本），会话不存在时返回None"""
+    entries = session_store.list(session_id)
+    if entries is None:
+        return None
+    filenames = {filename for filename, _ in entries}
+    with jobs_lock:
+        lazy = lazy_versions.get(session_id)
+        if lazy is not None:
+            filenames.update(lazy['files'])
+    return sorted(filenames)
+
+
+def lazy_version(session_id, filename):
+    """单个文件的ensure_version，按需生成时先申请准入，超出限额时抛出Rejected"""
+    ticket = admit_lazy(session_id, [filename])
+    try:
+        return ensure_version(session_id, filename, ticket)
+    finally:
+        if ticket is not None:
+            ticket.cancel()
+
+
+def iter_session_files(session_id, filenames, ticket=None):
+    """逐个返回(文件名, 文件路径或内容)，按需生成的版本在取到时才生成（工作量计入ticket，见admit_lazy）"""
+    for index, filename in enumerate(filenames):
+        source = ensure_version(session_id, filename, ticket, index)
+        if source is not None:
+            yield filename, source
+
+
+def run_job(session_id, index, filename, source, output_dir, num_versions, cache_key, encoder=DEFAULT_ENCODER,
+            ticket=None):
+    """
+    后台线程: 逐个生成一个文件的各个版本并实时更新任务进度，全部成功时写入结果缓存
+    
+    每个版本完成后立即存入会话，并把文件名、MD5和大小加入任务的versions列表，前端轮询/status即可逐个显示。
+    """
+    update_job(session_id, index, status='processing', versions=[])
+    profile = StageProfile()
+    status = 'error'
+    start = time.perf_counter()
+    try:
+        generated_count = 0
+        for result in iter_variants(source, num_versions=num_versions, engine=app.config['ENGINE'],
+                                    filename=filename, profile=profile,
+                                    max_tile_bytes=app.config['TILE_MEMORY_BYTES'], encoder=encoder,
+                                    md5_index=md5_index):
+            if result.md5 is not None:
+                session_store.put(session_id, result.filename, result.data, result.md5)
+                generated_count += 1
+            with jobs_lock:
+                entry = jobs[session_id]['files'][index]
+                entry['completed'] = result.index + 1
+                if result.md5 is not None:
+                    entry['versions'].append({
+                        'filename': result.filename,
+                        'md5': result.md5,
+                        'size': result.size,
+                        'url': f'/download_file/{session_id}/{result.filename}',
+                        'thumb_url': f'/thumb/{session_id}/{result.filename}',
+                    })
+        if generated_count == num_versions and cache_key is not None:
+            base_name, file_ext = os.path.splitext(filename)
+            result_cache.store(cache_key, num_versions, output_dir, base_name, file_ext)
+        update_job(session_id, index, status='done', generated_count=generated_count)
+        status = 'done'
+    except ValueError:
+        update_job(session_id, index, status='error', error='无法打开图片')
+    except Exception as e:
+        update_job(session_id, index, status='error', error=f'处理失败: {str(e)}')
+    finally:
+        seconds = time.perf_counter() - start
+        session_store.release(session_id)
+        if ticket is not None:
+            ticket.done(index, seconds)
+        record_job(profile, status, seconds)
+
+
+def record_job(profile, status, seconds):
+    """把一个文件的处理耗时和各阶段统计记入运行指标"""
+    JOB_SECONDS.observe(seconds, status)
+    JOBS.inc(status)
+    for stage, (_, stage_seconds) in profile.stages.items():
+        STAGE_SECONDS.observe(stage_seconds, stage)
+    counters = profile.counters
+    BYTES.inc('in', amount=counters.get('bytes_in', 0))
+    BYTES.inc('out', amount=counters.get('bytes_out', 0))
+    VERSIONS.inc(amount=counters.get('versions', 0))
+    RETRIES.inc(amount=counters.get('retries', 0))
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    if request.endpoint != 'metrics' and 'request_start' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, request.endpoint or 'unknown',
+                                str(response.status_code))
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus格式的运行指标: 请求和处理耗时直方图、队列长度、处理字节数等"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -49,63 +509,139 @@ def upload_file():
     if not allowed_file(file.filename):
         return jsonify({'error': '不支持的文件格式'}), 400
     
+    if pending_job_count() >= app.config['MAX_PENDING_JOBS']:
+        return jsonify({'error': '服务器繁忙，请稍后再试'}), 503
+    
+    try:
+        num_versions = parse_num_versions()
+    except ValueError:
+        return jsonify({'error': '生成数量必须是整数'}), 400
+    encoder = parse_encoder()
+    client = client_id()
+    try:
+        ticket = admit(client, [file], num_versions, encoder)
+    except Rejected as e:
+        return rejection(e)
+    
+    session_id = None
     try:
         filename = secure_filename(file.filename)
-        upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(upload_path)
-        
-        num_versions = int(request.form.get('num_versions', 3))
-        if num_versions < 1 or num_versions > 100:
-            num_versions = 3
+        session_id, output_dir = create_session()
         
-        # 为每个上传会话创建独立的文件夹（使用UUID）
-        session_id = str(uuid.uuid4())[:8]  # 使用UUID的前8位作为会话ID
-        output_dir = os.path.join(app.config['OUTPUT_FOLDER'], session_id)
-        os.makedirs(output_dir, exist_ok=True)
-        
-        process_image(upload_path, output_dir, num_versions)
-        
-        # 统计生成的文件数量
-        base_name = filename.rsplit('.', 1)[0]
-        file_ext = '.' + filename.rsplit('.', 1)[1] if '.' in filename else '.jpg'
-        
-        generated_count = 0
-        for i in range(1, num_versions + 1):
-            output_filename = f"{base_name}_v{i:02d}{file_ext}"
-            output_path = os.path.join(output_dir, output_filename)
-            if os.path.exists(output_path):
-                generated_count += 1
+        source = session_store.save_upload(session_id, filename, file)
         
-        original_md5 = calculate_md5(upload_path)
+        # 放入后台队列，立即返回会话ID，前端通过/status轮询进度
+        queue_files(session_id, output_dir, [(filename, source)], num_versions, encoder, client, ticket)
         
         return jsonify({
             'success': True,
             'filename': filename,
-            'generated_count': generated_count,
+            'status': 'queued',
             'total_files': num_versions,
             'session_id': session_id  # 返回会话ID
-        })
+        }), 202
     
     except Exception as e:
+        if ticket is not None:
+            ticket.cancel()
         return jsonify({'error': f'处理失败: {str(e)}'}), 500
+    finally:
+        if session_id is not None:
+            session_store.release(session_id)
+
+
+@app.route('/upload_batch', methods=['POST'])
+def upload_batch():
+    """一次上传多个文件，服务器并行处理，所有结果放在同一个会话中"""
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return jsonify({'error': '没有选择文件'}), 400
+    
+    accepted = [file for file in files if allowed_file(file.filename)]
+    rejected = [{'filename': file.filename, 'error': '不支持的文件格式'}
+                for file in files if not allowed_file(file.filename)]
+    if not accepted:
+        return jsonify({'error': '不支持的文件格式', 'rejected': rejected}), 400
+    
+    if pending_job_count() + len(accepted) > app.config['MAX_PENDING_JOBS']:
+        return jsonify({'error': '服务器繁忙，请稍后再试'}), 503
+    
+    try:
+        num_versions = parse_num_versions()
+    except ValueError:
+        return jsonify({'error': '生成数量必须是整数'}), 400
+    encoder = parse_encoder()
+    client = client_id()
+    try:
+        ticket = admit(client, accepted, num_versions, encoder)
+    except Rejected as e:
+        return rejection(e)
+    
+    session_id = None
+    try:
+        session_id, output_dir = create_session()
+        
+        uploads = []
+        taken = set()
+        for file in accepted:
+            filename = unique_filename(secure_filename(file.filename), taken)
+            uploads.append((filename, session_store.save_upload(session_id, filename, file)))
+        
+        queue_files(session_id, output_dir, uploads, num_versions, encoder, client, ticket)
+        
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'status': 'queued',
+            'total_files': num_versions * len(uploads),
+            'files': [{'filename': filename, 'total_files': num_versions} for filename, _ in uploads],
+            'rejected': rejected,
+        }), 202
+    
+    except Exception as e:
+        if ticket is not None:
+            ticket.cancel()
+        return jsonify({'error': f'处理失败: {str(e)}'}), 500
+    finally:
+        if session_id is not None:
+            session_store.release(session_id)
+
+
+@app.route('/status/<session_id>')
+def job_status(session_id):
+    """查询后台任务的处理进度"""
+    summary = job_summary(session_id)
+    if summary is None:
+        return jsonify({'error': '会话不存在或已过期'}), 404
+    return jsonify(summary)
+
+
+@app.route('/cache_stats')
+def cache_stats():
+    """结果缓存的命中/未命中次数和占用空间，以及会话存储、准入控制和全局MD5索引的状态"""
+    stats = result_cache.stats() if result_cache is not None else {}
+    stats['sessions'] = session_store.stats()
+    stats['admission'] = admission.stats()
+    if md5_index is not None:
+        stats['md5_index'] = md5_index.stats()
+    return jsonify(stats)
 
 
 @app.route('/download_all/<session_id>')
 def download_all(session_id):
     """下载指定会话的所有生成文件"""
-    output_dir = os.path.join(app.config['OUTPUT_FOLDER'], session_id)
-    if not os.path.exists(output_dir):
+    filenames = session_filenames(session_id)
+    if filenames is None:
         return jsonify({'error': '会话不存在或已过期'}), 404
     
     # 获取所有文件
     files = []
-    for filename in os.listdir(output_dir):
-        file_path = os.path.join(output_dir, filename)
-        if os.path.isfile(file_path):
-            files.append({
-                'filename': filename,
-                'url': f'/download_file/{session_id}/{filename}'
-            })
+    for filename in filenames:
+        files.append({
+            'filename': filename,
+            'url': f'/download_file/{session_id}/{filename}',
+            'thumb_url': f'/thumb/{session_id}/{filename}',
+        })
     
     return jsonify({
         'files': files,
@@ -113,13 +649,135 @@ def download_all(session_id):
     })
 
 
+class ZipStream:
+    """只写缓冲区: zipfile写入的数据暂存于此，由生成器分块取走（不可seek，zipfile会使用数据描述符）"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def pop(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def iter_zip(entries):
+    """
+    逐块生成ZIP内容（仅存储不压缩），内存占用与文件大小无关，不写临时文件
+    
+    entries为可迭代的(文件名, 文件路径或文件内容)
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for filename, source in entries:
+            if isinstance(source, bytes):
+                zinfo = zipfile.ZipInfo(filename, time.localtime()[:6])
+            else:
+                zinfo = zipfile.ZipInfo.from_file(source, filename)
+            zinfo.compress_type = zipfile.ZIP_STORED
+            with open_source(source) as src, archive.open(zinfo, 'w') as dst:
+                for chunk in iter(lambda: src.read(ZIP_CHUNK_SIZE), b""):
+                    dst.write(chunk)
+                    yield from stream.pop()
+            yield from stream.pop()
+    yield from stream.pop()
+
+
+@app.route('/download_zip/<session_id>')
+def download_zip(session_id):
+    """把指定会话的所有生成文件打包成ZIP流式下载"""
+    filenames = session_filenames(session_id)
+    if filenames is None:
+        return jsonify({'error': '会话不存在或已过期'}), 404
+    try:
+        ticket = admit_lazy(session_id, filenames)
+    except Rejected as e:
+        return rejection(e)
+    
+    response = Response(
+        stream_with_context(iter_zip(iter_session_files(session_id, filenames, ticket))),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=images_{session_id}.zip'},
+    )
+    if ticket is not None:
+        # 下载结束（或中断）后归还尚未生成的版本的工作量
+        response.call_on_close(ticket.cancel)
+    return response
+
+
+def send_immutable(source, filename, etag, mimetype=None):
+    """
+    发送内容不会再改变的文件（文件路径或文件内容）
+    
+    以MD5作为强ETag，If-None-Match相同时返回304，支持Range断点续传；
+    Cache-Control为private（只允许浏览器缓存）、一年有效和immutable，浏览器刷新时也不再请求。
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    mimetype = mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_file(source, mimetype=mimetype, download_name=filename, etag=etag, conditional=True,
+                         max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+
+def make_thumbnail(source, size=THUMB_SIZE):
+    """
+    生成JPEG缩略图（最长边size像素）
+    
+    Image.thumbnail对JPEG先用draft按1/2、1/4、1/8缩小解码，其他格式先用reduce整数倍缩小，
+    最后才精确缩放，不需要以原始分辨率解码和缩放整张图片。
+    """
+    with open_source(source) as f, Image.open(f) as image:
+        image.thumbnail((size, size), reducing_gap=2.0)
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=THUMB_QUALITY)
+    return output.getvalue()
+
+
 @app.route('/download_file/<session_id>/<filename>')
 def download_file(session_id, filename):
-    """下载指定会话的单个文件"""
-    directory = os.path.join(app.config['OUTPUT_FOLDER'], session_id)
-    if not os.path.exists(directory):
+    """下载指定会话的单个文件（按需生成模式下第一次下载时生成），以文件MD5作为ETag"""
+    try:
+        source = lazy_version(session_id, filename)
+    except Rejected as e:
+        return rejection(e)
+    md5 = session_store.md5(session_id, filename) if source is not None else None
+    if md5 is None:
+        return jsonify({'error': '会话不存在或已过期'}), 404
+    return send_immutable(source, filename, md5)
+
+
+@app.route('/thumb/<session_id>/<filename>')
+def thumbnail(session_id, filename):
+    """文件的缩略图，第一次请求时生成并保存在会话中，随会话一起删除"""
+    data = session_store.get_thumbnail(session_id, filename)
+    if data is None:
+        try:
+            source = lazy_version(session_id, filename)
+        except Rejected as e:
+            return rejection(e)
+        if source is None:
+            return jsonify({'error': '会话不存在或已过期'}), 404
+        try:
+            data = make_thumbnail(source)
+        except Exception as e:
+            return jsonify({'error': f'无法生成缩略图: {str(e)}'}), 500
+        session_store.put_thumbnail(session_id, filename, data)
+    md5 = session_store.md5(session_id, filename)
+    if md5 is None:
         return jsonify({'error': '会话不存在或已过期'}), 404
-    return send_from_directory(directory, filename)
+    base_name = os.path.splitext(filename)[0]
+    return send_immutable(data, f'{base_name}_thumb.jpg', f'{md5}-thumb{THUMB_SIZE}', 'image/jpeg')
 
 
 if __name__ == '__main__':
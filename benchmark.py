@@ -0,0 +1,375 @@
+"""
+图片MD5修改工具 - 性能基准测试
+在本地生成合成图片，测量各修改方法、各处理阶段和完整流程的耗时，结果保存为JSON并可与基线对比
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import itertools
+import platform
+import contextlib
+import multiprocessing
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+import PIL
+from PIL import Image, ImageEnhance
+import numpy as np
+
+import image_md5_modifier as modifier
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，改用psutil（已安装时）读取峰值内存
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# 各格式支持的颜色模式（JPEG不支持透明和调色板，GIF只有调色板）
+FORMAT_MODES = {
+    'JPEG': ('RGB',),
+    'PNG': ('RGB', 'RGBA', 'P'),
+    'GIF': ('P',),
+    'BMP': ('RGB', 'P'),
+}
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'BMP': '.bmp'}
+
+# 对比基线时使用的指标（越小越好）
+COMPARED_METRICS = ('seconds',)
+
+
+def synthetic_image(megapixels, mode, seed=0):
+    """生成4:3的合成图片: 平滑渐变叠加轻微噪声，接近照片的压缩特性"""
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = int(round(width * 3 / 4))
+    rng = np.random.default_rng(seed)
+    x, y = np.meshgrid(np.linspace(0, 255, width, dtype=np.float32),
+                       np.linspace(0, 255, height, dtype=np.float32))
+    channels = [x, y, (x + y) / 2]
+    if mode == 'RGBA':
+        channels.append(np.full((height, width), 200, dtype=np.float32))
+    array = np.stack(channels, axis=-1) + rng.normal(0, 6, (height, width, len(channels)))
+    image = Image.fromarray(np.clip(array, 0, 255).astype(np.uint8), 'RGBA' if mode == 'RGBA' else 'RGB')
+    if mode == 'P':
+        image = image.quantize(256)
+    return image
+
+
+def encode_source(image, fmt):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def timed(func, repeat):
+    """运行func repeat次，返回(中位数耗时, 最后一次的返回值)"""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), result
+
+
+def max_rss():
+    """当前进程的峰值常驻内存（字节），无法获得时返回None"""
+    if sys.platform.startswith('linux'):
+        # VmHWM只统计当前进程映像；ru_maxrss会继承fork时父进程的峰值，子进程中测不出增加的内存
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    if resource is not None:
+        # Linux上ru_maxrss单位为KB，macOS上为字节
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+    if psutil is not None:
+        return getattr(psutil.Process().memory_info(), 'peak_wset', None)  # 只有Windows提供
+    return None
+
+
+def run_pipeline(source, num_versions, engine, file_ext, max_tile_bytes=None, encoder=modifier.DEFAULT_ENCODER):
+    """完整流程（解码、生成、编码都在内存中，不写磁盘）"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        modifier.process_image(source, num_versions=num_versions, engine=engine, filename=f"bench{file_ext}",
+                               output_sink=lambda name, data: None, max_tile_bytes=max_tile_bytes, encoder=encoder)
+
+
+def _pipeline_rss(*args):
+    """子进程: 运行一次完整流程，返回运行前后的进程峰值常驻内存"""
+    before = max_rss()
+    run_pipeline(*args)
+    return before, max_rss()
+
+
+def peak_memory(*args):
+    """
+    在新的子进程中运行一次完整流程，返回峰值常驻内存比运行前增加的字节数，无法测量时返回None
+    
+    常驻内存包括Pillow在C中分配的图片缓冲区和编码器内存（tracemalloc只能统计Python和NumPy的分配），
+    每次使用新的子进程，峰值不受之前各项测量的影响。参数与run_pipeline相同。
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        before, after = executor.submit(_pipeline_rss, *args).result()
+    if before is None or after is None:
+        return None
+    return after - before
+
+
+def check_point_operations(trials=20, max_methods=4):
+    """
+    检查合并的颜色运算与逐个调用的结果是否一致（误差不超过±1），返回最大误差
+    
+    先在覆盖0-255全部取值的图片上运行亮度、对比度、饱和度的所有排列（1-3种），系数包括会使中间结果超出范围的值；
+    再在这张平滑图片和一张随机纹理图片上，把1-max_methods种修改方法的所有排列经apply_methods处理，
+    与逐个调用modify_image_method的结果比较（颜色运算与噪声、滤波、旋转、缩放的顺序不能交换）。
+    """
+    enhancers = {'brightness': ImageEnhance.Brightness, 'contrast': ImageEnhance.Contrast,
+                 'color': ImageEnhance.Color}
+    ramp = np.arange(256, dtype=np.uint8)
+    pixels = np.stack(np.broadcast_arrays(ramp[None, :], ramp[:, None], ramp[::-1, None] ^ ramp[None, :]), axis=-1)
+    image = Image.fromarray(np.ascontiguousarray(pixels), 'RGB')
+    rng = np.random.default_rng(0)
+    
+    def difference(first, second):
+        return int(np.abs(np.asarray(first, dtype=np.int16) - np.asarray(second, dtype=np.int16)).max())
+    
+    worst = 0
+    for length in (1, 2, 3):
+        for kinds in itertools.permutations(enhancers, length):
+            for _ in range(trials):
+                point_ops = [(kind, float(rng.uniform(0.5, 1.5))) for kind in kinds]
+                expected = image
+                for kind, factor in point_ops:
+                    expected = enhancers[kind](expected).enhance(factor)
+                worst = max(worst, difference(modifier.apply_point_operations(image, point_ops), expected))
+    
+    # 修改方法较慢，排列较多，使用缩小的平滑图片（取值仍分布在0-255）和随机纹理图片
+    smooth = Image.fromarray(np.ascontiguousarray(pixels[::4, ::4]), 'RGB')
+    textured = Image.fromarray(rng.integers(0, 256, (48, 64, 3), dtype=np.uint8), 'RGB')
+    for sample in (smooth, textured):
+        for length in range(1, max_methods + 1):
+            for methods in itertools.permutations(modifier.MODIFICATION_METHODS, length):
+                seed = int(rng.integers(1, 1000000))
+                expected = sample
+                for method_idx, method in enumerate(methods):
+                    expected = method(expected, seed + method_idx * 100)
+                worst = max(worst, difference(modifier.apply_methods(sample, methods, seed), expected))
+    return worst
+
+
+def bench_methods(sizes, repeat, results):
+    """逐个测量modify_image_method1-8在不同尺寸RGB图片上的耗时"""
+    for megapixels in sizes:
+        image = synthetic_image(megapixels, 'RGB')
+        image.load()
+        for method in modifier.MODIFICATION_METHODS:
+            seconds, _ = timed(lambda: method(image, 12345), repeat)
+            name = f"method/{method.__name__}/{megapixels}MP"
+            results[name] = {'seconds': seconds, 'mp_per_s': megapixels / seconds}
+            print(f"  {name:<40} {seconds * 1000:9.1f} ms  {megapixels / seconds:8.1f} MP/s")
+
+
+def bench_case(megapixels, mode, fmt, num_versions, repeat, results, max_tile_bytes=None,
+               encoder=modifier.DEFAULT_ENCODER):
+    """测量一种(尺寸, 颜色模式, 格式)组合的各处理阶段和完整流程"""
+    file_ext = FORMAT_EXTENSIONS[fmt]
+    source = encode_source(synthetic_image(megapixels, mode), fmt)
+    case = f"{megapixels}MP/{mode}/{fmt}"
+    
+    def decode():
+        image = Image.open(io.BytesIO(source))
+        image.load()
+        return image
+    
+    stages = {}
+    stages['decode'], decoded = timed(decode, repeat)
+    stages['convert'], image = timed(lambda: decoded.convert('RGB'), repeat)
+    plan = modifier.MODIFICATION_METHODS[1:4]
+    stages['methods'], modified = timed(lambda: modifier.apply_methods(image, plan, 12345), repeat)
+    stages['encode'], data = timed(lambda: modifier.encode_variant(modified, file_ext, encoder), repeat)
+    stages['hash'], _ = timed(lambda: hashlib.md5(data).hexdigest(), repeat)
+    for stage, seconds in stages.items():
+        results[f"stage/{stage}/{case}"] = {'seconds': seconds, 'mp_per_s': megapixels / seconds if seconds else None}
+    
+    # 各编码配置的速度和文件大小
+    for profile in modifier.ENCODERS:
+        seconds, encoded = timed(lambda: modifier.encode_variant(modified, file_ext, profile), repeat)
+        results[f"encode/{profile}/{case}"] = {
+            'seconds': seconds,
+            'mp_per_s': megapixels / seconds,
+            'bytes': len(encoded),
+        }
+    
+    # 逐个生成版本（与process_image的classic引擎相同的流程），统计重试率；unique为写入版本标记的唯一标记模式
+    def versions(reserved=None):
+        generated_md5s = {hashlib.md5(source).hexdigest()}
+        retries = 0
+        for i in range(num_versions):
+            rng, seed, selected = modifier.variant_plan(0, i)
+            result = modifier._generate_version(
+                image, i, seed, selected, f"v{i}{file_ext}", file_ext,
+                generated_md5s, lambda name, data: None, rng, encoder, reserved=reserved)
+            retries += result[1] if result is not None else 0
+        return retries
+    
+    reserved = modifier.stamp_region(np.asarray(image, dtype=np.uint8))
+    for name, version_reserved in (('versions', None), ('versions-unique', reserved)):
+        seconds, retries = timed(lambda: versions(version_reserved), 1)
+        results[f"{name}/{case}"] = {
+            'seconds': seconds,
+            'seconds_per_version': seconds / num_versions,
+            'mp_per_s': megapixels * num_versions / seconds,
+            'retry_rate': retries / num_versions,
+        }
+    retries = results[f"versions/{case}"]['retry_rate'] * num_versions
+    
+    # 完整流程，峰值内存在单独的子进程中测量
+    for engine in modifier.ENGINES:
+        args = (source, num_versions, engine, file_ext, max_tile_bytes, encoder)
+        seconds, _ = timed(lambda: run_pipeline(*args), repeat)
+        results[f"pipeline/{engine}/{case}"] = {
+            'seconds': seconds,
+            'mp_per_s': megapixels * num_versions / seconds,
+            'peak_rss_bytes': peak_memory(*args),
+        }
+    
+    print(f"  {case:<20} 解码 {stages['decode'] * 1000:7.1f} ms  转换 {stages['convert'] * 1000:7.1f} ms  "
+          f"修改 {stages['methods'] * 1000:7.1f} ms  编码 {stages['encode'] * 1000:7.1f} ms  "
+          f"MD5 {stages['hash'] * 1000:6.1f} ms  重试率 {retries / num_versions:.0%}")
+    for name in ('versions', 'versions-unique'):
+        entry = results[f"{name}/{case}"]
+        print(f"  {'':<20} {name:<16} 每个版本 {entry['seconds_per_version'] * 1000:7.1f} ms  "
+              f"重试率 {entry['retry_rate']:.0%}")
+    for profile in modifier.ENCODERS:
+        entry = results[f"encode/{profile}/{case}"]
+        print(f"  {'':<20} 编码 {profile:<9} {entry['seconds'] * 1000:7.1f} ms  {entry['mp_per_s']:7.1f} MP/s  "
+              f"{entry['bytes'] / 1024:9.1f} KB")
+    for engine in modifier.ENGINES:
+        entry = results[f"pipeline/{engine}/{case}"]
+        peak = entry['peak_rss_bytes']
+        print(f"  {'':<20} {engine:<8} {entry['seconds']:7.2f} s  {entry['mp_per_s']:7.1f} MP/s  "
+              f"峰值内存 {'+' + format(peak / 1024 / 1024, '.1f') + ' MB' if peak is not None else '无法测量'}")
+
+
+def compare(results, baseline, threshold):
+    """与基线对比，返回[(指标名, 基线值, 当前值, 变化比例)]中变慢超过threshold的项"""
+    regressions = []
+    for name, entry in sorted(results.items()):
+        base_entry = baseline.get('results', {}).get(name)
+        if base_entry is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = base_entry.get(metric), entry.get(metric)
+            if not old or new is None:
+                continue
+            change = new / old - 1
+            if change > threshold:
+                regressions.append((f"{name}:{metric}", old, new, change))
+    return regressions
+
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='图片MD5修改工具 - 性能基准测试',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例用法:
+  python benchmark.py                                  # 默认尺寸、模式和格式
+  python benchmark.py --sizes 1,4 --formats JPEG,PNG -o result.json
+  python benchmark.py -o new.json --baseline result.json --threshold 0.1
+        """
+    )
+    parser.add_argument('--sizes', default='1,4,12', help='图片尺寸，单位百万像素，逗号分隔（默认：1,4,12）')
+    parser.add_argument('--modes', default='RGB,RGBA,P', help='颜色模式，逗号分隔（默认：RGB,RGBA,P）')
+    parser.add_argument('--formats', default='JPEG,PNG,GIF,BMP', help='图片格式，逗号分隔（默认：JPEG,PNG,GIF,BMP）')
+    parser.add_argument('-n', '--num', type=int, default=5, help='完整流程每次生成的版本数量（默认：5）')
+    parser.add_argument('--repeat', type=int, default=3, help='每项测量重复次数，取中位数（默认：3）')
+    parser.add_argument('--tile-memory', type=int, default=0,
+                        help='完整流程使用分块处理，临时内存上限单位MB（默认：0，不分块）')
+    parser.add_argument('--encoder', choices=modifier.ENCODERS, default=modifier.DEFAULT_ENCODER,
+                        help='各阶段和完整流程使用的编码配置（默认：balanced）')
+    parser.add_argument('--skip-methods', action='store_true', help='不单独测量各修改方法')
+    parser.add_argument('-o', '--output', default=None, help='结果JSON文件')
+    parser.add_argument('--baseline', default=None, help='基线JSON文件，用于对比')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='耗时超过基线的比例达到该值时视为性能回退（默认：0.10）')
+    
+    args = parser.parse_args()
+    sizes = parse_list(args.sizes, float)
+    modes = parse_list(args.modes)
+    formats = [fmt.upper() for fmt in parse_list(args.formats)]
+    for fmt in formats:
+        if fmt not in FORMAT_MODES:
+            parser.error(f'不支持的格式: {fmt}')
+    
+    point_ops_error = check_point_operations()
+    print(f"合并颜色运算与逐个调用修改方法的最大误差: {point_ops_error}")
+    if point_ops_error > 1:
+        print("错误: 合并颜色运算的结果与ImageEnhance不一致")
+        sys.exit(1)
+    print()
+    
+    results = {}
+    if not args.skip_methods:
+        print("各修改方法耗时:")
+        bench_methods(sizes, args.repeat, results)
+        print()
+    
+    print(f"各处理阶段和完整流程（每次 {args.num} 个版本）:")
+    for megapixels in sizes:
+        for fmt in formats:
+            for mode in FORMAT_MODES[fmt]:
+                if mode in modes:
+                    bench_case(megapixels, mode, fmt, args.num, args.repeat, results,
+                               args.tile_memory * 1024 * 1024 or None, args.encoder)
+    
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    maxrss = max_rss()
+    if maxrss is not None:
+        report['meta']['max_rss_bytes'] = maxrss
+        print(f"\n进程峰值内存: {report['meta']['max_rss_bytes'] / 1024 / 1024:.1f} MB")
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存: {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n发现 {len(regressions)} 项性能回退（阈值 {args.threshold:.0%}）:")
+            for name, old, new, change in regressions:
+                print(f"  {name:<50} {old:.4f} -> {new:.4f}  (+{change:.0%})")
+            sys.exit(1)
+        print(f"\n与基线相比没有超过 {args.threshold:.0%} 的性能回退")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+图片MD5修改工具 - 轻量客户端
+参数与image_md5_modifier.py相同。常驻进程（image_md5_daemon.py）运行时把参数交给它处理，
+省去每次启动时导入NumPy和Pillow的时间；常驻进程未运行时在当前进程中直接处理。
+本模块只导入标准库中启动很快的模块。
+"""
+
+import os
+import sys
+import json
+import socket
+
+
+# 常驻进程的地址和访问令牌，只有当前用户可读
+STATE_FILE = os.path.join(os.path.expanduser('~'), '.image_md5_daemon.json')
+
+# 连接常驻进程的超时（秒），超时视为未运行
+CONNECT_TIMEOUT = 0.5
+
+
+def read_state():
+    """读取常驻进程的状态文件，不存在或无法解析时返回None"""
+    try:
+        with open(STATE_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def connect(state):
+    if 'socket' in state:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(state['socket'])
+        except OSError:
+            sock.close()
+            raise
+    else:
+        sock = socket.create_connection(tuple(state['address']), timeout=CONNECT_TIMEOUT)
+    sock.settimeout(None)
+    return sock
+
+
+def request(message, state=None):
+    """
+    向常驻进程发送一条请求，逐条返回应答消息（每条是一个JSON对象）
+    
+    常驻进程未运行时在取第一条消息时抛出OSError。
+    """
+    state = state or read_state()
+    if state is None:
+        raise ConnectionRefusedError('常驻进程未运行')
+    with connect(state) as sock, sock.makefile('rb') as responses:
+        sock.sendall(json.dumps(dict(message, token=state['token'])).encode('utf-8') + b'\n')
+        for line in responses:
+            yield json.loads(line)
+
+
+def run_remote(argv):
+    """交给常驻进程处理并实时输出结果，返回退出码；常驻进程未运行时返回None"""
+    responses = request({'command': 'run', 'argv': argv, 'cwd': os.getcwd()})
+    try:
+        response = next(responses)
+    except (OSError, StopIteration):
+        return None
+    
+    try:
+        while True:
+            if 'error' in response:
+                print(f"错误: {response['error']}", file=sys.stderr)
+                return 1
+            if 'exit_code' in response:
+                return response['exit_code']
+            sys.stdout.write(response['output'])
+            sys.stdout.flush()
+            response = next(responses)
+    except (OSError, StopIteration):
+        print("错误: 与常驻进程的连接中断", file=sys.stderr)
+        return 1
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    exit_code = run_remote(argv)
+    if exit_code is None:
+        # 常驻进程未运行: 在当前进程中处理（此时才导入NumPy和Pillow）
+        import image_md5_modifier
+        image_md5_modifier.main(argv)
+        exit_code = 0
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+图片MD5修改工具 - 常驻进程
+预先导入NumPy、Pillow并启动一组工作进程，接受image_md5_client.py发来的任务，
+处理单张小图时省去每次启动Python和导入模块的时间
+"""
+
+import os
+import sys
+import json
+import hmac
+import secrets
+import argparse
+import threading
+import contextlib
+import socketserver
+from concurrent.futures import ProcessPoolExecutor
+
+import image_md5_modifier
+from image_md5_client import STATE_FILE, read_state, request
+
+
+class SocketWriter:
+    """任务进程中代替sys.stdout和sys.stderr，把输出按行发送给客户端"""
+    
+    def __init__(self, sock):
+        self.sock = sock
+        self.pending = ''
+    
+    def write(self, text):
+        self.pending += text
+        if '\n' in self.pending:
+            lines, _, self.pending = self.pending.rpartition('\n')
+            self.send({'output': lines + '\n'})
+        return len(text)
+    
+    def flush(self):
+        if self.pending:
+            self.send({'output': self.pending})
+            self.pending = ''
+    
+    def send(self, message):
+        try:
+            self.sock.sendall(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+        except OSError:
+            pass  # 客户端已断开，任务继续完成
+
+
+def _warm():
+    """让工作进程提前启动（导入本模块时已导入NumPy和Pillow）"""
+    return os.getpid()
+
+
+def run_job(sock, argv, cwd):
+    """
+    工作进程: 在客户端的工作目录中运行image_md5_modifier的命令行，输出实时发送给客户端
+    
+    sock为客户端连接（由进程池传入的副本），最后发送{'exit_code': 退出码}后关闭。
+    """
+    writer = SocketWriter(sock)
+    exit_code = 0
+    try:
+        os.chdir(cwd)
+        sys.argv = ['image_md5_client.py'] + argv  # 用法提示中显示客户端的文件名
+        with contextlib.redirect_stdout(writer), contextlib.redirect_stderr(writer):
+            image_md5_modifier.main(argv)
+    except SystemExit as e:
+        if isinstance(e.code, str):
+            writer.write(e.code + '\n')
+            exit_code = 1
+        else:
+            exit_code = e.code or 0
+    except Exception as e:
+        writer.write(f"错误: {e}\n")
+        exit_code = 1
+    finally:
+        writer.flush()
+        writer.send({'exit_code': exit_code})
+        sock.close()
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """每个连接一条JSON请求: run运行任务，ping查询状态，stop停止常驻进程"""
+    
+    def reply(self, message):
+        self.wfile.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+    
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        if not hmac.compare_digest(str(message.get('token', '')), self.server.token):
+            self.reply({'error': '访问令牌错误'})
+            return
+        
+        command = message.get('command')
+        if command == 'run':
+            future = self.server.pool.submit(run_job, self.connection, list(message['argv']), message['cwd'])
+            try:
+                future.result()
+            except Exception as e:
+                self.reply({'error': f'工作进程出错: {e}'})
+        elif command == 'ping':
+            self.reply({'pid': os.getpid(), 'workers': self.server.workers})
+        elif command == 'stop':
+            self.reply({'stopping': True})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+        else:
+            self.reply({'error': f'未知命令: {command}'})
+
+
+class TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else:  # Windows只支持本机TCP
+    UnixServer = None
+
+
+def write_state(state):
+    """写入状态文件（只有当前用户可读写）"""
+    fd = os.open(STATE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+
+
+def running_daemon():
+    """返回正在运行的常驻进程的状态（ping应答），未运行时返回None"""
+    try:
+        return next(request({'command': 'ping'}))
+    except (OSError, StopIteration):
+        return None
+
+
+def serve(workers, host='127.0.0.1', port=0, socket_path=None):
+    """启动常驻进程，直到收到stop命令或Ctrl+C"""
+    if socket_path is not None:
+        if UnixServer is None:
+            raise ValueError('当前系统不支持Unix套接字，请使用--port')
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(socket_path)
+        server = UnixServer(socket_path, JobHandler)
+        os.chmod(socket_path, 0o600)
+        state = {'socket': os.path.abspath(socket_path)}
+    else:
+        server = TCPServer((host, port), JobHandler)
+        state = {'address': list(server.server_address[:2])}
+    
+    server.token = secrets.token_hex(16)
+    server.workers = workers
+    with server, ProcessPoolExecutor(max_workers=workers) as pool:
+        server.pool = pool
+        for future in [pool.submit(_warm) for _ in range(workers)]:
+            future.result()
+        write_state(dict(state, token=server.token, pid=os.getpid()))
+        where = state.get('socket') or '{}:{}'.format(*state['address'])
+        print(f"常驻进程已启动: {where}，{workers} 个工作进程（按 Ctrl+C 停止）")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if (read_state() or {}).get('pid') == os.getpid():
+                os.remove(STATE_FILE)
+            if socket_path is not None:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(socket_path)
+    print("常驻进程已停止")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='图片MD5修改工具 - 常驻进程',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例用法:
+  python image_md5_daemon.py                   # 启动常驻进程（本机TCP，端口自动选择）
+  python image_md5_daemon.py --socket /tmp/md5.sock -j 4
+  python image_md5_client.py image.jpg -n 5    # 参数与image_md5_modifier.py相同
+  python image_md5_daemon.py --status
+  python image_md5_daemon.py --stop
+        """
+    )
+    parser.add_argument('-j', '--workers', type=int, default=0,
+                        help='常驻的工作进程数，0表示CPU核心数（默认：0）')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址（默认：127.0.0.1，只接受本机连接）')
+    parser.add_argument('--port', type=int, default=0, help='监听端口（默认：0，自动选择）')
+    parser.add_argument('--socket', default=None, help='改为监听Unix套接字文件（Linux/macOS）')
+    parser.add_argument('--status', action='store_true', help='查询常驻进程是否在运行')
+    parser.add_argument('--stop', action='store_true', help='停止正在运行的常驻进程')
+    
+    args = parser.parse_args()
+    status = running_daemon()
+    if args.status or args.stop:
+        if status is None:
+            print("常驻进程未运行")
+            sys.exit(1)
+        if args.stop:
+            next(request({'command': 'stop'}))
+            print(f"已停止常驻进程 (PID {status['pid']})")
+        else:
+            print(f"常驻进程正在运行 (PID {status['pid']}，{status['workers']} 个工作进程)")
+        return
+    
+    if status is not None:
+        print(f"常驻进程已在运行 (PID {status['pid']})")
+        sys.exit(1)
+    serve(args.workers or os.cpu_count() or 1, args.host, args.port, args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,114 @@
 """
 
 import os
+import io
+import re
+import glob
+import asyncio
+import threading
+import time
 import hashlib
+import json
+import uuid
+import zlib
+import struct
 import random
+import secrets
+import sqlite3
 import argparse
-from PIL import Image, ImageEnhance, ImageFilter
+import functools
+import itertools
+import contextlib
+import contextvars
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import shared_memory
+from PIL import Image, ImageEnhance, ImageFilter, ImageStat
 import numpy as np
 
+from md5_index import DEFAULT_INDEX_PATH, open_index
+
+
+class StageProfile:
+    """
+    记录各处理阶段的耗时和计数（解码、转换、各修改方法、编码、MD5、重试等）
+    
+    通过process_image(profile=...)启用；未启用时各阶段只多一次ContextVar查询，没有计时开销。
+    子进程中的阶段耗时会合并进来，所以多进程时各阶段耗时之和可能大于总耗时。
+    """
+    
+    def __init__(self):
+        self.stages = {}    # 阶段名 -> [次数, 总耗时(秒)]
+        self.counters = {}  # 计数名 -> 数值（versions、retries、bytes_in、bytes_out等）
+    
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+    
+    def add(self, name, seconds, calls=1):
+        entry = self.stages.setdefault(name, [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+    
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def merge(self, data):
+        """合并另一个StageProfile.as_dict()的结果"""
+        for name, entry in data['stages'].items():
+            self.add(name, entry['seconds'], entry['calls'])
+        for name, amount in data['counters'].items():
+            self.count(name, amount)
+    
+    def as_dict(self):
+        return {
+            'stages': {name: {'calls': calls, 'seconds': seconds}
+                       for name, (calls, seconds) in self.stages.items()},
+            'counters': dict(self.counters),
+        }
+    
+    def summary(self):
+        """打印按耗时排序的各阶段统计"""
+        total = sum(seconds for _, seconds in self.stages.values()) or 1
+        print("\n各阶段耗时:")
+        for name, (calls, seconds) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+            print(f"  {name:<32} {seconds * 1000:10.1f} ms  {calls:6d} 次  {seconds / total:6.1%}")
+        for name, amount in sorted(self.counters.items()):
+            print(f"  {name:<32} {amount}")
+
+
+# 当前正在记录的StageProfile（每个线程/任务独立），为None时不计时
+_active_profile = contextvars.ContextVar('md5_profile', default=None)
+_NO_STAGE = contextlib.nullcontext()
+
+
+def _stage(name):
+    profile = _active_profile.get()
+    return _NO_STAGE if profile is None else profile.stage(name)
+
+
+def _count(name, amount=1):
+    profile = _active_profile.get()
+    if profile is not None:
+        profile.count(name, amount)
+
+
+@contextlib.contextmanager
+def recording(profile):
+    """在此范围内把各阶段耗时记录到profile（为None时不记录）"""
+    if profile is None:
+        yield
+        return
+    token = _active_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _active_profile.reset(token)
+
 
 def calculate_md5(file_path):
     """计算文件的MD5值"""
@@ -21,74 +123,86 @@ def calculate_md5(file_path):
 
 
 def modify_image_method1(image, seed):
-    """方法1: 添加微小的随机噪声"""
-    random.seed(seed)
-    np.random.seed(seed % (2**32))  # numpy的seed需要是32位整数
+    """方法1: 添加微小的随机噪声（启用分块处理时逐条带生成噪声，见tiling）"""
+    max_tile_bytes = _tile_memory.get()
+    if max_tile_bytes is not None:
+        return add_noise_tiled(image, seed, max_tile_bytes)
+    rng = np.random.default_rng(seed % (2**32))  # numpy的seed需要是32位整数
     img_array = np.array(image)
-    noise = np.random.randint(-3, 4, img_array.shape, dtype=np.int16)
+    noise = rng.integers(-3, 4, img_array.shape, dtype=np.int16)
     img_array = np.clip(img_array.astype(np.int16) + noise, 0, 255).astype(np.uint8)
     return Image.fromarray(img_array)
 
 
+def _enhance_factor(seed, spread=0.02):
+    """方法2/3/4/6使用的随机调整系数"""
+    return 1.0 + random.Random(seed).uniform(-spread, spread)
+
+
 def modify_image_method2(image, seed):
     """方法2: 轻微调整亮度"""
-    random.seed(seed)
     enhancer = ImageEnhance.Brightness(image)
-    factor = 1.0 + random.uniform(-0.02, 0.02)  # 轻微的亮度调整
+    factor = _enhance_factor(seed)  # 轻微的亮度调整
     return enhancer.enhance(factor)
 
 
 def modify_image_method3(image, seed):
     """方法3: 轻微调整对比度"""
-    random.seed(seed)
     enhancer = ImageEnhance.Contrast(image)
-    factor = 1.0 + random.uniform(-0.02, 0.02)
+    factor = _enhance_factor(seed)
     return enhancer.enhance(factor)
 
 
 def modify_image_method4(image, seed):
     """方法4: 轻微调整饱和度"""
-    random.seed(seed)
     enhancer = ImageEnhance.Color(image)
-    factor = 1.0 + random.uniform(-0.02, 0.02)
+    factor = _enhance_factor(seed)
     return enhancer.enhance(factor)
 
 
 def modify_image_method5(image, seed):
     """方法5: 添加极小的模糊然后锐化"""
-    random.seed(seed)
     blurred = image.filter(ImageFilter.GaussianBlur(radius=0.1))
     return blurred.filter(ImageFilter.SHARPEN)
 
 
 def modify_image_method6(image, seed):
     """方法6: 轻微调整锐度"""
-    random.seed(seed)
     enhancer = ImageEnhance.Sharpness(image)
-    factor = 1.0 + random.uniform(-0.02, 0.02)
+    factor = _enhance_factor(seed)
     return enhancer.enhance(factor)
 
 
 def modify_image_method7(image, seed):
     """方法7: 轻微旋转（小于0.2度）然后裁剪回原尺寸"""
-    random.seed(seed)
-    angle = random.uniform(-0.1, 0.1)
+    angle = random.Random(seed).uniform(-0.1, 0.1)
     rotated = image.rotate(angle, expand=False, fillcolor='white')
     return rotated
 
 
-def modify_image_method8(image, seed):
-    """方法8: 组合多种轻微调整"""
-    random.seed(seed)
-    # 轻微调整大小然后缩放回来
-    scale = 1.0 + random.uniform(-0.001, 0.001)
+def _method8_params(seed):
+    """方法8使用的随机缩放比例和亮度系数"""
+    rng = random.Random(seed)
+    scale = 1.0 + rng.uniform(-0.001, 0.001)
+    factor = 1.0 + rng.uniform(-0.005, 0.005)
+    return scale, factor
+
+
+def _resize_jitter(image, scale):
+    """轻微调整大小然后缩放回来"""
     new_width = int(image.width * scale)
     new_height = int(image.height * scale)
     resized = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-    final = resized.resize((image.width, image.height), Image.Resampling.LANCZOS)
+    return resized.resize((image.width, image.height), Image.Resampling.LANCZOS)
+
+
+def modify_image_method8(image, seed):
+    """方法8: 组合多种轻微调整"""
+    scale, factor = _method8_params(seed)
+    final = _resize_jitter(image, scale)
     # 再添加轻微亮度调整
     enhancer = ImageEnhance.Brightness(final)
-    return enhancer.enhance(1.0 + random.uniform(-0.005, 0.005))
+    return enhancer.enhance(factor)
 
 
 # 所有修改方法的列表
@@ -104,141 +218,1190 @@ MODIFICATION_METHODS = [
 ]
 
 
-def process_image(input_path, output_dir=None, num_versions=3):
+# 生成模式: pixel修改像素后重新编码, container只在文件中插入附加数据段（不解码像素）
+MODES = ('pixel', 'container')
+
+# 可选的处理引擎: classic逐个版本处理, batch一次性批量生成噪声版本
+ENGINES = ('classic', 'batch')
+
+# batch引擎单批处理的内存上限（字节），超出时自动分块
+DEFAULT_BATCH_MEMORY = 512 * 1024 * 1024
+
+# 编码配置: fast编码最快, balanced兼顾速度和大小, smallest文件最小（PNG无损，JPEG质量略低）
+# JPEG的质量在quality-2到quality之间按版本序号变化；GIF、BMP等格式没有可调参数
+ENCODER_PROFILES = {
+    'fast': {
+        'jpeg': {'quality': 90, 'optimize': False, 'progressive': False, 'subsampling': '4:2:0'},
+        'png': {'compress_level': 1},
+    },
+    'balanced': {
+        'jpeg': {'quality': 92, 'optimize': True, 'progressive': False, 'subsampling': '4:2:0'},
+        'png': {'compress_level': 6},
+    },
+    'smallest': {
+        'jpeg': {'quality': 85, 'optimize': True, 'progressive': True, 'subsampling': '4:2:0'},
+        'png': {'optimize': True},
+    },
+}
+ENCODERS = tuple(ENCODER_PROFILES)
+DEFAULT_ENCODER = 'balanced'
+
+# 唯一标记模式: 版本序号的每一位对应左上角一个与JPEG的DCT块对齐的8x8像素块，
+# 位为1时块内亮度比基准高STAMP_DELTA，为0时低STAMP_DELTA
+STAMP_BITS = 16
+STAMP_BLOCK = 8
+STAMP_DELTA = 2
+UNIQUE_MAX_VERSIONS = 2 ** STAMP_BITS
+
+
+# 可合并为一次颜色运算的逐像素方法
+POINT_OPERATIONS = {
+    modify_image_method2: 'brightness',
+    modify_image_method3: 'contrast',
+    modify_image_method4: 'color',
+}
+
+
+def _expand_method(method, seed):
+    """把一个修改方法拆分为颜色运算('brightness'等, 系数)和滤波步骤(None, 函数)"""
+    if method in POINT_OPERATIONS:
+        return [(POINT_OPERATIONS[method], _enhance_factor(seed))]
+    if method is modify_image_method8:
+        scale, factor = _method8_params(seed)
+        return [(None, functools.partial(_resize_jitter, scale=scale)), ('brightness', factor)]
+    return [(None, functools.partial(method, seed=seed))]
+
+
+def plan_methods(methods, seed):
+    """
+    把修改方法组合编译为尽量少的处理步骤
+    
+    相邻的亮度、对比度、饱和度都是逐像素运算，在原来的位置合并为一个('point', 运算列表)步骤（见apply_point_operations），
+    对比度及其后连续的亮度调整只需一次查找表。噪声、模糊、锐化、旋转、缩放都是分隔点，不与颜色运算交换顺序:
+    每一步都会截断到[0, 255]，滤波还会过冲，交换后的结果与逐个调用相差可达10级。
+    """
+    stages = []
+    point_ops = None
+    for method_idx, method in enumerate(methods):
+        for kind, value in _expand_method(method, seed + method_idx * 100):
+            if kind is None:
+                stages.append(('filter', value))
+                point_ops = None
+            else:
+                if point_ops is None:
+                    point_ops = []
+                    stages.append(('point', point_ops))
+                point_ops.append((kind, value))
+    return stages
+
+
+def _enhance_lut(luts, kind, factor, mean=0):
+    """
+    对每个通道的查找表应用一步亮度或对比度调整
+    
+    与ImageEnhance（Image.blend）相同: 以黑色或平均灰度为中心按系数混合，每一步都截断到[0, 255]并向下取整；
+    Pillow用单精度浮点数计算，这里也用float32，否则恰好落在整数附近的值取整结果会差1，经后续步骤放大。
+    """
+    degenerate = np.float32(0 if kind == 'brightness' else mean)
+    return np.floor(np.clip(degenerate + np.float32(factor) * (luts - degenerate), 0, 255))
+
+
+def apply_point_operations(image, point_ops):
+    """
+    依次完成多个颜色运算，结果与逐个调用ImageEnhance相同（误差不超过±1）
+    
+    连续的亮度/对比度调整逐步作用于0-255的每通道查找表（每一步都截断，近0或255时与逐个调用一致），
+    合并为一次image.point。对比度的中心是当前图片的平均灰度，需要先应用已合并的查找表再统计；
+    饱和度会混合三个通道，无法用查找表表示，同样先应用已合并的查找表，再调用ImageEnhance.Color。
+    """
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    luts = None  # 尚未应用的每通道查找表，形状为(3, 256)
+    for kind, factor in point_ops:
+        if kind != 'brightness' and luts is not None:
+            image = image.point(luts.astype(np.uint8).ravel().tolist())
+            luts = None
+        if kind == 'color':
+            image = ImageEnhance.Color(image).enhance(factor)
+            continue
+        mean = 0
+        if kind == 'contrast':
+            # 与ImageEnhance.Contrast相同: 灰度图的平均值四舍五入为整数
+            mean = int(ImageStat.Stat(image.convert('L')).mean[0] + 0.5)
+        if luts is None:
+            luts = np.tile(np.arange(256, dtype=np.float32), (3, 1))
+        luts = _enhance_lut(luts, kind, factor, mean)
+    if luts is not None:
+        image = image.point(luts.astype(np.uint8).ravel().tolist())
+    return image
+
+
+def apply_methods(image, methods, seed):
+    """按plan_methods编译后的步骤应用多种修改方法，返回RGB图片"""
+    modified_image = image
+    for kind, stage in plan_methods(methods, seed):
+        if kind == 'point':
+            with _stage('method:point'):
+                modified_image = apply_point_operations(modified_image, stage)
+        else:
+            with _stage('method:' + stage.func.__name__):
+                modified_image = stage(modified_image)
+    if modified_image.mode != 'RGB':
+        modified_image = modified_image.convert('RGB')
+    return modified_image
+
+
+def perturb_batch(source_array, seeds):
+    """批量添加微小随机噪声，一次生成形状为(N, H, W, C)的uint8数组（每个版本的噪声只由各自的种子决定）"""
+    stack = np.empty((len(seeds),) + source_array.shape, dtype=np.int16)
+    for index, seed in enumerate(seeds):
+        stack[index] = np.random.default_rng(seed % (2**32)).integers(-3, 4, source_array.shape, dtype=np.int16)
+    stack += source_array
+    np.clip(stack, 0, 255, out=stack)
+    return stack.astype(np.uint8)
+
+
+def batch_size(source_array, num_versions, max_batch_bytes=DEFAULT_BATCH_MEMORY):
+    """根据内存上限计算每批版本数（int16噪声 + uint8结果，约为原图的3倍）"""
+    per_version = source_array.nbytes * 3
+    return max(1, min(num_versions, max_batch_bytes // per_version))
+
+
+# 当前的分块处理内存上限（字节），为None时整张图片一次处理
+_tile_memory = contextvars.ContextVar('md5_tile_memory', default=None)
+
+
+@contextlib.contextmanager
+def tiling(max_tile_bytes):
+    """
+    在此范围内按条带处理逐像素的噪声（方法1和batch引擎）
+    
+    每个条带单独生成噪声并直接写入uint8结果，临时内存不超过max_tile_bytes，
+    峰值内存约为原图加结果各一份，适合在内存较小的机器上处理上亿像素的图片。
+    噪声由(种子, 条带序号)决定，所以同一种子在不同内存上限下的结果不同。
+    max_tile_bytes为None时不分块。
+    """
+    token = _tile_memory.set(max_tile_bytes)
+    try:
+        yield
+    finally:
+        _tile_memory.reset(token)
+
+
+def tile_rows(width, channels, max_tile_bytes):
+    """每个条带的行数: 条带的uint8副本和int16噪声约为每像素每通道4字节"""
+    return max(1, max_tile_bytes // (width * channels * 4))
+
+
+def _perturb_strip(src, dst, seed):
+    """给一个条带添加±3噪声，结果写入dst（uint8）"""
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(-3, 4, src.shape, dtype=np.int16)
+    noise += src
+    np.clip(noise, 0, 255, out=noise)
+    dst[...] = noise
+
+
+def _image_from_array(array, mode):
+    """把uint8数组包装成PIL图片，RGB/RGBA/L直接共享内存不再复制"""
+    if mode in ('L', 'RGB', 'RGBA'):
+        return Image.frombuffer(mode, (array.shape[1], array.shape[0]), array, 'raw', mode, 0, 1)
+    return Image.fromarray(array)
+
+
+def add_noise_tiled(image, seed, max_tile_bytes):
+    """按条带逐块添加微小随机噪声，每个条带从原图裁剪后处理，不整体转换为int16"""
+    width, height = image.size
+    channels = len(image.getbands())
+    rows = tile_rows(width, channels, max_tile_bytes)
+    out = np.empty((height, width, channels) if channels > 1 else (height, width), dtype=np.uint8)
+    for index, top in enumerate(range(0, height, rows)):
+        strip = np.asarray(image.crop((0, top, width, min(height, top + rows))))
+        _perturb_strip(strip, out[top:top + rows], [seed % (2**32), index])
+    return _image_from_array(out, image.mode)
+
+
+def iter_tiled_images(source_array, seeds, max_tile_bytes):
+    """batch引擎的分块版本: 逐个版本按条带添加噪声，同一时间只有一个结果数组"""
+    height, width = source_array.shape[:2]
+    channels = source_array.shape[2] if source_array.ndim == 3 else 1
+    rows = tile_rows(width, channels, max_tile_bytes)
+    mode = {1: 'L', 3: 'RGB', 4: 'RGBA'}[channels]
+    for seed in seeds:
+        out = np.empty_like(source_array)
+        with _stage('noise_tiled'):
+            for index, top in enumerate(range(0, height, rows)):
+                _perturb_strip(source_array[top:top + rows], out[top:top + rows], [seed % (2**32), index])
+        yield _image_from_array(out, mode)
+        del out
+
+
+def iter_batch_images(source_array, seeds, max_batch_bytes=DEFAULT_BATCH_MEMORY):
+    """按内存上限分块批量生成版本，逐个返回PIL图片（启用分块处理时逐个版本按条带生成）"""
+    max_tile_bytes = _tile_memory.get()
+    if max_tile_bytes is not None:
+        yield from iter_tiled_images(source_array, seeds, max_tile_bytes)
+        return
+    size = batch_size(source_array, len(seeds), max_batch_bytes)
+    for start in range(0, len(seeds), size):
+        with _stage('noise_batch'):
+            stack = perturb_batch(source_array, seeds[start:start + size])
+        for variant in stack:
+            yield Image.fromarray(variant)
+        del stack
+
+
+def stamp_region(source_array):
+    """
+    唯一标记模式的保留区域: 原图左上角的像素块，取值限制在[STAMP_DELTA, 255-STAMP_DELTA]内
+    
+    所有版本的保留区域都以它为基准，只有各位对应的块亮度不同。PNG、BMP无损保存，
+    JPEG中每个块的直流系数相差16*STAMP_DELTA，大于各编码配置的量化步长，所以不同序号的版本一定不同。
+    """
+    height, width = source_array.shape[:2]
+    columns = min(width // STAMP_BLOCK, STAMP_BITS)
+    rows = -(-STAMP_BITS // columns) if columns else 0
+    if columns == 0 or rows * STAMP_BLOCK > height:
+        raise ValueError(f"图片太小，无法写入版本标记（至少需要 {STAMP_BLOCK}x{STAMP_BLOCK * STAMP_BITS} 像素）")
+    region = source_array[:rows * STAMP_BLOCK, :columns * STAMP_BLOCK]
+    return np.clip(region, STAMP_DELTA, 255 - STAMP_DELTA).astype(np.int16)
+
+
+def stamp_version(image, index, base):
+    """把版本序号写入RGB图片左上角的保留区域（直接修改image），返回image"""
+    rows, columns = base.shape[0] // STAMP_BLOCK, base.shape[1] // STAMP_BLOCK
+    bits = (index >> np.arange(rows * columns)) & 1
+    offsets = np.where(bits, STAMP_DELTA, -STAMP_DELTA).reshape(rows, columns)
+    offsets = offsets.repeat(STAMP_BLOCK, axis=0).repeat(STAMP_BLOCK, axis=1)[..., None]
+    image.paste(Image.fromarray((base + offsets).astype(np.uint8)), (0, 0))
+    return image
+
+
+def _stamp_palette(image, index):
+    """GIF: 量化为255色，版本序号写入调色板中图片不使用的最后一项"""
+    paletted = image.convert('P', palette=Image.Palette.ADAPTIVE, colors=255)
+    palette = paletted.getpalette()
+    palette += [0] * (768 - len(palette))
+    palette[765:] = [index >> 16 & 255, index >> 8 & 255, index & 255]
+    paletted.putpalette(palette)
+    return paletted
+
+
+def encode_variant(image, file_ext, encoder=DEFAULT_ENCODER, variation=0, stamp=None):
+    """
+    按输出格式和编码配置把图片编码到内存，返回文件内容
+    
+    variation（版本序号加重试次数）让JPEG质量在配置值和低2档之间变化，进一步区分各版本。
+    stamp为(版本序号, stamp_region返回的保留区域)时写入版本标记: GIF写入调色板，
+    其他格式写入左上角的保留区域（直接修改image）。
+    """
+    buffer = io.BytesIO()
+    profile = ENCODER_PROFILES[encoder]
+    file_ext = file_ext.lower()
+    if stamp is not None:
+        with _stage('stamp'):
+            index, base = stamp
+            image = _stamp_palette(image, index) if file_ext == '.gif' else stamp_version(image, index, base)
+    if file_ext in ['.jpg', '.jpeg']:
+        options = dict(profile['jpeg'])
+        options['quality'] -= variation % 3
+        image.save(buffer, 'JPEG', **options)
+    elif file_ext == '.png':
+        image.save(buffer, 'PNG', **profile['png'])
+    elif file_ext == '.gif' and stamp is not None:
+        # 不优化调色板，否则未使用的最后一项会被删除
+        image.save(buffer, 'GIF', optimize=False)
+    else:
+        image.save(buffer, Image.registered_extensions().get(file_ext, 'PNG'))
+    return buffer.getvalue()
+
+
+def write_variant(output_path, data):
+    """一次性写入编码好的文件内容"""
+    with open(output_path, 'wb') as f:
+        f.write(data)
+
+
+def variant_plan(master_seed, index):
+    """
+    第index个版本（从0开始）的随机数生成器、随机种子和修改方法组合
+    
+    只由(主种子, 版本序号)决定，与其他版本无关，所以任意一个版本都可以单独重新生成。
+    返回的随机数生成器继续用于该版本MD5重复时的重试。
+    """
+    state = np.random.SeedSequence([master_seed, index]).generate_state(2, dtype=np.uint64)
+    rng = random.Random(int(state[0]) << 64 | int(state[1]))
+    seed = rng.randint(1, 999999)
+    num_methods = rng.randint(2, 4)  # 随机选择2-4种方法组合使用，增强效果
+    return rng, seed, rng.sample(MODIFICATION_METHODS, min(num_methods, len(MODIFICATION_METHODS)))
+
+
+def _generate_version(original_image, i, seed, selected_methods, output_filename, file_ext, generated_md5s,
+                      write, rng, encoder=DEFAULT_ENCODER, first_image=None, first_encoded=None, reserved=None,
+                      md5_index=None):
+    """
+    生成单个版本，MD5重复时用rng换用新的随机种子和修改方法组合重试
+    
+    每次尝试都只在内存中编码并计算MD5，确认唯一后才调用write(文件名, 文件内容)保存。
+    first_image为预先生成的首次尝试图片，first_encoded为子进程已编码的(文件内容, MD5)。
+    reserved为stamp_region返回的保留区域时写入版本标记，各版本的MD5一定不同，不会重试。
+    md5_index为MD5Index时MD5还要在全局索引中登记成功（之前的批次和其他进程都未生成过）才算唯一，
+    保存失败时删除登记。
+    成功返回(MD5, 重试次数, 文件大小, 文件内容)，失败返回None。
+    """
+    max_retries = 10  # 最多重试10次
+    retry_count = 0
+    
+    while retry_count < max_retries:
+        try:
+            if retry_count == 0 and first_encoded is not None:
+                data, new_md5 = first_encoded
+            else:
+                if retry_count == 0 and first_image is not None:
+                    modified_image = first_image
+                else:
+                    # 组合应用多种修改方法
+                    modified_image = apply_methods(original_image, selected_methods, seed + retry_count * 1000)
+                
+                with _stage('encode'):
+                    data = encode_variant(modified_image, file_ext, encoder, i + retry_count,
+                                          None if reserved is None else (i, reserved))
+                
+                # 计算新版本的MD5（直接使用内存中的内容，无需重新读取文件）
+                with _stage('hash'):
+                    new_md5 = hashlib.md5(data).hexdigest()
+            
+            # 检查MD5是否唯一（使用全局索引时原子地登记，登记失败说明其他批次已生成过）
+            claimed = False
+            if new_md5 not in generated_md5s and md5_index is not None:
+                claimed = md5_index.add(new_md5)
+            if new_md5 in generated_md5s or (md5_index is not None and not claimed):
+                retry_count += 1
+                _count('retries')
+                if retry_count < max_retries:
+                    # 如果重复，使用新的随机种子和更强的修改方法组合
+                    seed = rng.randint(1, 999999)
+                    # 使用更多方法组合（3-5种），图片在下一次循环中生成
+                    num_retry_methods = rng.randint(3, 5)
+                    selected_methods = rng.sample(MODIFICATION_METHODS,
+                                                  min(num_retry_methods, len(MODIFICATION_METHODS)))
+                    continue
+                else:
+                    print(f"警告: 版本 {i+1} 经过 {max_retries} 次尝试后仍可能重复MD5")
+                    if md5_index is not None:
+                        claimed = md5_index.add(new_md5)
+            
+            # MD5唯一，保存结果；保存失败时删除登记，否则重试时会把同一个MD5当作已生成过
+            with _stage('write'):
+                try:
+                    write(output_filename, data)
+                except Exception:
+                    if claimed:
+                        md5_index.discard(new_md5)
+                    raise
+            generated_md5s.add(new_md5)
+            return new_md5, retry_count, len(data), data
+        
+        except Exception as e:
+            retry_count += 1
+            if retry_count >= max_retries:
+                print(f"✗ 生成版本 {i+1} 时出错: {e}\n")
+                break
+            continue
+    
+    return None
+
+
+def _iter_serial_first_attempts(original_image, seeds, engine, max_batch_bytes):
+    """单进程: 逐个返回(首次尝试图片, None)，batch引擎按内存上限分块批量生成"""
+    if engine == 'batch':
+        # 只解码一次，按内存上限分块批量生成首次尝试的图片
+        source_array = np.asarray(original_image, dtype=np.uint8)
+        for image in iter_batch_images(source_array, seeds, max_batch_bytes):
+            yield image, None
+    else:
+        for _ in seeds:
+            yield None, None
+
+
+# 子进程中共享内存里的原图（由_init_worker设置）
+_worker_shm = None
+_worker_source = None
+
+
+def _init_worker(shm_name, shape):
+    """子进程初始化: 挂载共享内存中的原图，避免每个任务都传递一份图片副本"""
+    global _worker_shm, _worker_source
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_source = np.ndarray(shape, dtype=np.uint8, buffer=_worker_shm.buf)
+
+
+def _render_first_attempts(jobs, engine, file_ext, max_batch_bytes, profile=False, max_tile_bytes=None,
+                           encoder=DEFAULT_ENCODER, unique=False):
+    """
+    子进程: 为一组版本生成并编码首次尝试
+    
+    返回(每个版本的(文件内容, MD5)列表, 各阶段耗时)，profile为False时各阶段耗时为None。
+    """
+    stage_profile = StageProfile() if profile else None
+    with recording(stage_profile), tiling(max_tile_bytes):
+        seeds = [seed for _, seed, _ in jobs]
+        reserved = stamp_region(_worker_source) if unique else None
+        if engine == 'batch':
+            images = iter_batch_images(_worker_source, seeds, max_batch_bytes)
+        else:
+            original_image = Image.fromarray(_worker_source)
+            images = (apply_methods(original_image, methods, seed) for _, seed, methods in jobs)
+        
+        results = []
+        for (i, _, _), image in zip(jobs, images):
+            with _stage('encode'):
+                data = encode_variant(image, file_ext, encoder, i, None if reserved is None else (i, reserved))
+            with _stage('hash'):
+                results.append((data, hashlib.md5(data).hexdigest()))
+    return results, stage_profile.as_dict() if profile else None
+
+
+def _iter_parallel_first_attempts(original_image, seeds, plans, file_ext, engine, max_batch_bytes, workers,
+                                  encoder=DEFAULT_ENCODER, unique=False):
+    """
+    多进程: 原图解码后放入共享内存，由进程池并行生成各版本的首次尝试
+    
+    按版本顺序逐个返回(None, (文件内容, MD5))，由主进程检查MD5并写入磁盘；
+    子进程失败的版本返回(None, None)由主进程重新生成。
+    """
+    source_array = np.asarray(original_image, dtype=np.uint8)
+    shm = shared_memory.SharedMemory(create=True, size=source_array.nbytes)
+    try:
+        np.ndarray(source_array.shape, dtype=np.uint8, buffer=shm.buf)[:] = source_array
+        
+        jobs = list(zip(range(len(seeds)), seeds, plans))
+        if engine == 'batch':
+            # 每个进程各自分块，总内存仍受max_batch_bytes限制
+            max_batch_bytes = max(1, max_batch_bytes // workers)
+            size = batch_size(source_array, -(-len(jobs) // workers), max_batch_bytes)
+        else:
+            size = 1
+        chunks = [jobs[start:start + size] for start in range(0, len(jobs), size)]
+        
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(shm.name, source_array.shape)) as executor:
+            profile = _active_profile.get()
+            futures = [executor.submit(_render_first_attempts, chunk, engine, file_ext, max_batch_bytes,
+                                       profile is not None, _tile_memory.get(), encoder, unique)
+                       for chunk in chunks]
+            try:
+                for chunk, future in zip(chunks, futures):
+                    try:
+                        with _stage('wait_workers'):
+                            results, worker_profile = future.result()
+                        if profile is not None:
+                            profile.merge(worker_profile)
+                    except Exception:
+                        results = [None] * len(chunk)
+                    for encoded in results:
+                        yield None, encoded
+            finally:
+                # 提前结束（例如iter_variants被关闭）时不再等待尚未开始的任务
+                for future in futures:
+                    future.cancel()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+class VariantResult(namedtuple('VariantResult', 'index filename data path md5 size retries seconds')):
+    """
+    一个版本的生成结果（iter_variants逐个返回）
+    
+    index为版本序号（从0开始），filename为输出文件名，data为文件内容（直接流式写入磁盘时为None），
+    path为写入的文件路径（未写入磁盘时为None），size为文件大小（字节），retries为MD5重复的重试次数，
+    seconds为生成该版本的耗时（秒）。生成失败的版本md5、data和path都为None。
+    """
+    
+    __slots__ = ()
+
+
+# 流式复制时每次读取的字节数
+CONTAINER_CHUNK_SIZE = 1024 * 1024
+
+
+def _copy_stream(src, emit, length=None):
+    """分块复制文件内容，length为None时复制到文件末尾"""
+    while length is None or length > 0:
+        size = CONTAINER_CHUNK_SIZE if length is None else min(CONTAINER_CHUNK_SIZE, length)
+        chunk = src.read(size)
+        if not chunk:
+            break
+        emit(chunk)
+        if length is not None:
+            length -= len(chunk)
+
+
+def open_source(source):
+    """把图片路径、bytes或文件对象统一为可读取的二进制文件对象（用于with语句）"""
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, 'rb')
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    source.seek(0)
+    return contextlib.nullcontext(source)
+
+
+def write_container_variant(src, dst, payload):
+    """
+    不解码像素，流式复制原文件并插入一个附加数据段，返回新文件的MD5
+    
+    src和dst为二进制文件对象。JPEG在APPn段之后插入COM段，PNG在IHDR之后插入tEXt块，
+    GIF在结尾标记前插入注释扩展，其他格式把数据附加在文件末尾。内存占用与图片大小无关。
+    """
+    hash_md5 = hashlib.md5()
+    
+    def emit(data):
+        dst.write(data)
+        hash_md5.update(data)
+    
+    src.seek(0)
+    head = src.read(33)
+    file_size = src.seek(0, os.SEEK_END)
+    src.seek(-1, os.SEEK_END)
+    last_byte = src.read(1)
+    inserted = True
+    
+    if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+        # 签名(8) + IHDR块(长度4 + 类型4 + 数据13 + CRC4)
+        emit(head)
+        src.seek(33)
+        chunk = b'tEXt' + b'Comment\x00' + payload
+        emit(struct.pack('>I', len(chunk) - 4) + chunk + struct.pack('>I', zlib.crc32(chunk)))
+    elif head.startswith(b'\xff\xd8'):
+        emit(b'\xff\xd8')
+        src.seek(2)
+        # 保留开头的APPn段（JFIF/EXIF/ICC等），在其后插入COM段
+        while True:
+            marker = src.read(4)
+            if len(marker) < 4 or marker[0] != 0xFF or not 0xE0 <= marker[1] <= 0xEF:
+                src.seek(-len(marker), os.SEEK_CUR)
+                break
+            emit(marker)
+            _copy_stream(src, emit, struct.unpack('>H', marker[2:])[0] - 2)
+        emit(b'\xff\xfe' + struct.pack('>H', len(payload) + 2) + payload)
+    elif head.startswith((b'GIF87a', b'GIF89a')) and last_byte == b'\x3b':
+        # 注释扩展是GIF89a的特性，放在结尾标记之前
+        emit(b'GIF89a')
+        src.seek(6)
+        _copy_stream(src, emit, file_size - 7)
+        emit(b'\x21\xfe' + bytes([len(payload)]) + payload + b'\x00\x3b')
+        src.seek(file_size)
+    else:
+        inserted = False
+        src.seek(0)
+    
+    _copy_stream(src, emit)
+    if not inserted:
+        emit(payload)
+    
+    return hash_md5.hexdigest()
+
+
+def _process_container(source, output_dir, output_sink, base_name, file_ext, num_versions, progress=None,
+                       seed=None, md5_index=None):
+    """container模式: 每个版本写入不同的附加数据段，MD5天然唯一，无需解码和重新编码（逐个返回VariantResult）"""
+    hash_md5 = hashlib.md5()
+    with _stage('hash'), open_source(source) as src:
+        _copy_stream(src, hash_md5.update)
+    original_md5 = hash_md5.hexdigest()
+    print(f"原始图片MD5: {original_md5}")
+    print(f"开始生成 {num_versions} 个不同版本...\n")
+    
+    # 本次运行的随机标识，保证不同批次生成的文件之间也不重复（指定种子时为种子的MD5，结果可重现且长度固定，
+    # 种子再大也不会超出GIF注释等附加数据段的长度限制）
+    token = uuid.uuid4().hex if seed is None else hashlib.md5(str(seed).encode('ascii')).hexdigest()
+    generated_md5s = set([original_md5])
+    version_count = 0
+    
+    for i in range(num_versions):
+        start = time.perf_counter()
+        output_filename = f"{base_name}_v{i+1:02d}{file_ext}"
+        output_path = data = None
+        payload = f"v{i+1:02d}-{token}".encode('ascii')
+        try:
+            with _stage('container_write'), open_source(source) as src:
+                if output_sink is None:
+                    output_path = os.path.join(output_dir, output_filename)
+                    with open(output_path, 'wb') as dst:
+                        new_md5 = write_container_variant(src, dst, payload)
+                        file_size = dst.tell()
+                else:
+                    dst = io.BytesIO()
+                    new_md5 = write_container_variant(src, dst, payload)
+                    file_size = dst.tell()
+                    data = dst.getvalue()
+                    output_sink(output_filename, data)
+        except Exception as e:
+            print(f"✗ 生成版本 {i+1} 时出错: {e}\n")
+            new_md5 = None
+        seconds = time.perf_counter() - start
+        if progress is not None:
+            progress(i + 1, num_versions)
+        if new_md5 is None:
+            yield VariantResult(i, output_filename, None, None, None, 0, 0, seconds)
+            continue
+        
+        generated_md5s.add(new_md5)
+        if md5_index is not None and not md5_index.add(new_md5):
+            print(f"警告: 版本 {i+1} 的MD5已在全局索引中（指定相同种子重复生成时会出现）")
+        version_count += 1
+        _count('versions')
+        _count('bytes_out', file_size)
+        print(f"✓ 版本 {i+1:2d}: {output_filename}")
+        print(f"  MD5: {new_md5}")
+        print(f"  大小: {file_size / 1024:.2f} KB\n")
+        yield VariantResult(i, output_filename, data, output_path, new_md5, file_size, 0, seconds)
+    
+    _print_summary(version_count, output_dir, generated_md5s)
+    return version_count
+
+
+def _print_summary(version_count, output_dir, generated_md5s):
+    """输出处理结果汇总"""
+    print(f"\n完成! 成功生成 {version_count} 个版本")
+    if output_dir is None:
+        print("所有版本已交给输出存储")
+    else:
+        print(f"所有版本保存在: {os.path.abspath(output_dir)}")
+    print(f"共 {len(generated_md5s)} 个不同的MD5值")
+    print(f"\n作者：小杨 | 微信：Zi_ming1020 | 欢迎反馈")
+
+
+def process_image(input_path, output_dir=None, num_versions=3, engine='classic',
+                  max_batch_bytes=DEFAULT_BATCH_MEMORY, workers=1, mode='pixel', progress=None,
+                  filename=None, output_sink=None, profile=None, max_tile_bytes=None, seed=None,
+                  encoder=DEFAULT_ENCODER, unique=False, md5_index=None):
     """
     处理图片，生成多个不同MD5的版本
     
     Args:
-        input_path: 输入图片路径
+        input_path: 输入图片路径，也可以是图片内容(bytes)或二进制文件对象
         output_dir: 输出目录，如果为None则使用输入文件所在目录
         num_versions: 要生成的版本数量（默认3个）
+        engine: 处理引擎，classic逐个组合修改方法，batch只解码一次并批量添加噪声
+        max_batch_bytes: batch引擎单批内存上限（字节）
+        workers: 并行生成版本的进程数，大于1时原图通过共享内存传给子进程
+        mode: 生成模式，pixel修改像素，container只插入附加数据段（速度接近文件复制）
+        progress: 进度回调progress(已完成版本数, 总版本数)，每个版本处理完后调用
+        filename: 原始文件名，用于生成输出文件名（默认取自input_path）
+        output_sink: 输出回调output_sink(文件名, 文件内容)，指定后不写磁盘，忽略output_dir
+        profile: StageProfile对象，指定后记录各处理阶段的耗时和计数（profile.as_dict()获取结构化数据）
+        max_tile_bytes: 分块处理的临时内存上限（字节），指定后逐像素的噪声按条带处理，适合超大图片
+        seed: 主随机种子，相同的图片、种子和参数总是生成相同的版本（默认随机选择并打印）
+        encoder: 编码配置，fast/balanced/smallest（见ENCODER_PROFILES）
+        unique: 唯一标记模式，把版本序号写入每个版本（见stamp_region），各版本MD5一定不同，无需重试
+        md5_index: 全局MD5索引（索引文件路径或MD5Index），指定后生成的MD5与之前所有批次都不重复
+    
+    Returns:
+        成功生成的版本数，无法处理时返回None
+    """
+    with recording(profile), tiling(max_tile_bytes):
+        return _drain(_process_image(input_path, output_dir, num_versions, engine, max_batch_bytes, workers,
+                                     mode, progress, filename, output_sink, seed, encoder, unique, md5_index))
+
+
+def _drain(generator):
+    """运行生成器直到结束，返回其返回值"""
+    while True:
+        try:
+            next(generator)
+        except StopIteration as stop:
+            return stop.value
+
+
+def iter_variants(input_path, output_dir=None, num_versions=3, engine='classic',
+                  max_batch_bytes=DEFAULT_BATCH_MEMORY, workers=1, mode='pixel', filename=None, profile=None,
+                  max_tile_bytes=None, seed=None, encoder=DEFAULT_ENCODER, unique=False, md5_index=None):
+    """
+    逐个生成版本，每个版本完成后立即返回一个VariantResult（包括生成失败的版本）
+    
+    参数（包括位置参数的顺序）与process_image相同。output_dir为None时不写文件，各版本只在VariantResult.data中；
+    指定output_dir时写入该目录并设置VariantResult.path。无法打开图片或参数错误时抛出ValueError。
+    各阶段耗时记录和分块处理的设置只在生成器内部生效，迭代期间不影响调用者的代码。
     """
+    output_sink = None if output_dir is not None else (lambda name, data: None)
+    
+    def run():
+        with recording(profile), tiling(max_tile_bytes):
+            return (yield from _process_image(input_path, output_dir, num_versions, engine, max_batch_bytes,
+                                              workers, mode, None, filename, output_sink, seed, encoder, unique,
+                                              md5_index))
+    
+    context = contextvars.copy_context()
+    generator = run()
+    try:
+        while True:
+            try:
+                result = context.run(next, generator)
+            except StopIteration as stop:
+                if stop.value is None:
+                    raise ValueError(f"无法处理图片: {filename or input_path}") from None
+                return
+            yield result
+    finally:
+        context.run(generator.close)
+
+
+async def aiter_variants(input_path, output_dir=None, num_versions=3, **options):
+    """
+    iter_variants的异步版本: 在后台线程中生成各版本，逐个返回VariantResult，不阻塞事件循环
+    
+    最多预先生成2个版本等待取走；提前结束迭代时，后台线程在当前版本完成后停止。
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=2)
+    stopped = threading.Event()
+    
+    def put(item):
+        try:
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+        except RuntimeError:  # 事件循环已关闭
+            stopped.set()
+    
+    def run():
+        try:
+            for result in iter_variants(input_path, output_dir, num_versions, **options):
+                if stopped.is_set():
+                    return
+                put((result, None))
+            put((None, None))
+        except Exception as e:
+            if not stopped.is_set():
+                put((None, e))
+    
+    threading.Thread(target=run, name='iter-variants', daemon=True).start()
+    try:
+        while True:
+            result, error = await queue.get()
+            if error is not None:
+                raise error
+            if result is None:
+                return
+            yield result
+    finally:
+        stopped.set()
+        while not queue.empty():
+            queue.get_nowait()
+
+
+def _resolve_index(md5_index):
+    """md5_index可以是索引文件路径（同一进程中共用一个MD5Index）或MD5Index对象"""
+    if isinstance(md5_index, (str, os.PathLike)):
+        return open_index(md5_index)
+    return md5_index
+
+
+def _load_image(input_path):
+    """读取并解码原图（只读取一次文件，同时用于计算MD5和解码），返回(文件内容, RGB图片)"""
+    with _stage('read'), open_source(input_path) as f:
+        source_data = f.read()
+    with _stage('decode'):
+        original_image = Image.open(io.BytesIO(source_data))
+        original_image.load()
+    # 转换为RGB模式（确保兼容性）
+    if original_image.mode != 'RGB':
+        with _stage('convert'):
+            original_image = original_image.convert('RGB')
+    return source_data, original_image
+
+
+def _process_image(input_path, output_dir, num_versions, engine, max_batch_bytes, workers, mode, progress,
+                   filename, output_sink, seed, encoder, unique, md5_index):
+    if mode not in MODES:
+        print(f"错误: 不支持的生成模式 - {mode}")
+        return
+    if engine not in ENGINES:
+        print(f"错误: 不支持的处理引擎 - {engine}")
+        return
+    if encoder not in ENCODER_PROFILES:
+        print(f"错误: 不支持的编码配置 - {encoder}")
+        return
+    if unique and num_versions > UNIQUE_MAX_VERSIONS:
+        print(f"错误: 唯一标记模式最多生成 {UNIQUE_MAX_VERSIONS} 个版本")
+        return
+    
     # 检查输入文件是否存在
-    if not os.path.exists(input_path):
+    is_path = isinstance(input_path, (str, os.PathLike))
+    if is_path and not os.path.exists(input_path):
         print(f"错误: 文件不存在 - {input_path}")
         return
+    if filename is None:
+        filename = input_path if is_path else getattr(input_path, 'name', None) or 'image.jpg'
+    try:
+        md5_index = _resolve_index(md5_index)
+    except sqlite3.Error as e:
+        print(f"错误: 无法打开MD5索引 - {e}")
+        return
     
-    # 创建输出目录
-    if output_dir is None:
-        output_dir = os.path.dirname(input_path) or "."
-    os.makedirs(output_dir, exist_ok=True)
+    # 创建输出目录（使用output_sink时不写磁盘）
+    if output_sink is not None:
+        output_dir = None
+        write = output_sink
+    else:
+        if output_dir is None:
+            output_dir = (os.path.dirname(input_path) if is_path else '') or "."
+        os.makedirs(output_dir, exist_ok=True)
+        write = lambda name, data: write_variant(os.path.join(output_dir, name), data)
+    
+    # 获取原始文件名（不含扩展名）
+    base_name = os.path.splitext(os.path.basename(filename))[0]
+    file_ext = os.path.splitext(filename)[1] or '.jpg'
+    
+    if mode == 'container':
+        return (yield from _process_container(input_path, output_dir, output_sink, base_name, file_ext,
+                                              num_versions, progress, seed, md5_index))
     
     # 读取原始图片
     try:
-        original_image = Image.open(input_path)
-        # 转换为RGB模式（确保兼容性）
-        if original_image.mode != 'RGB':
-            original_image = original_image.convert('RGB')
+        source_data, original_image = _load_image(input_path)
     except Exception as e:
         print(f"错误: 无法打开图片 - {e}")
         return
-    
-    # 获取原始文件名（不含扩展名）
-    base_name = os.path.splitext(os.path.basename(input_path))[0]
-    file_ext = os.path.splitext(input_path)[1] or '.jpg'
+    _count('bytes_in', len(source_data))
+    _count('megapixels', original_image.width * original_image.height / 1e6)
+    reserved = None
+    if unique:
+        try:
+            reserved = stamp_region(np.asarray(original_image, dtype=np.uint8))
+        except ValueError as e:
+            print(f"错误: {e}")
+            return
     
     # 计算原始图片的MD5
-    original_md5 = calculate_md5(input_path)
+    with _stage('hash'):
+        original_md5 = hashlib.md5(source_data).hexdigest()
     print(f"原始图片MD5: {original_md5}")
+    
+    # 每个版本的随机数生成器、随机种子和修改方法组合都由(主种子, 版本序号)决定
+    if seed is None:
+        seed = secrets.randbits(32)
+    print(f"随机种子: {seed}（使用 --seed {seed} 可重新生成相同的版本）")
+    if unique:
+        print("唯一标记模式: 每个版本写入版本序号，MD5一定不同，无需重试")
+    if md5_index is not None:
+        print(f"全局MD5索引: {md5_index.path}（已有 {len(md5_index)} 条记录）")
     print(f"开始生成 {num_versions} 个不同版本...\n")
+    variant_plans = [variant_plan(seed, i) for i in range(num_versions)]
+    rngs = [rng for rng, _, _ in variant_plans]
+    seeds = [variant_seed for _, variant_seed, _ in variant_plans]
+    plans = [methods for _, _, methods in variant_plans]
+    output_filenames = [f"{base_name}_v{i+1:02d}{file_ext}" for i in range(num_versions)]
     
     # 生成多个版本
     generated_md5s = set([original_md5])
     version_count = 0
     
-    for i in range(num_versions):
-        # 使用随机种子
-        seed = random.randint(1, 999999)
+    if workers > 1 and num_versions > 1:
+        first_results = _iter_parallel_first_attempts(
+            original_image, seeds, plans, file_ext, engine, max_batch_bytes, workers, encoder, unique)
+    else:
+        first_results = _iter_serial_first_attempts(original_image, seeds, engine, max_batch_bytes)
+    
+    start = time.perf_counter()
+    for i, (first_image, first_encoded) in enumerate(first_results):
+        result = _generate_version(
+            original_image, i, seeds[i], plans[i], output_filenames[i], file_ext, generated_md5s,
+            write, rngs[i], encoder, first_image=first_image, first_encoded=first_encoded, reserved=reserved,
+            md5_index=md5_index)
+        seconds = time.perf_counter() - start
+        if progress is not None:
+            progress(i + 1, num_versions)
+        if result is None:
+            yield VariantResult(i, output_filenames[i], None, None, None, 0, 0, seconds)
+            start = time.perf_counter()
+            continue
         
-        # 随机选择2-4种方法组合使用，增强效果
-        num_methods = random.randint(2, 4)
-        selected_methods = random.sample(MODIFICATION_METHODS, min(num_methods, len(MODIFICATION_METHODS)))
+        new_md5, retry_count, file_size, data = result
+        output_path = None if output_dir is None else os.path.join(output_dir, output_filenames[i])
+        version_count += 1
+        _count('versions')
+        _count('bytes_out', file_size)
+        output_filename = output_filenames[i]
+        file_size = file_size / 1024  # KB
+        if retry_count > 0:
+            print(f"✓ 版本 {i+1:2d}: {output_filename} (重试 {retry_count} 次)")
+        else:
+            print(f"✓ 版本 {i+1:2d}: {output_filename}")
+        print(f"  MD5: {new_md5}")
+        print(f"  大小: {file_size:.2f} KB\n")
+        yield VariantResult(i, output_filename, data, output_path, new_md5, len(data), retry_count, seconds)
+        start = time.perf_counter()
+    
+    _print_summary(version_count, output_dir, generated_md5s)
+    return version_count
+
+
+def generate_variant(input_path, index, seed, engine='classic', filename=None, generated_md5s=None,
+                     max_tile_bytes=None, encoder=DEFAULT_ENCODER, unique=False, md5_index=None):
+    """
+    单独生成第index个版本（从0开始），无需先生成前面的版本
+    
+    相同的图片、主种子seed和引擎下，结果与process_image(seed=seed)生成的对应版本相同
+    （除非该版本在process_image中因MD5重复而重试过）。
+    generated_md5s为已生成版本的MD5集合，用于保证唯一，新版本的MD5会加入其中；
+    md5_index为全局MD5索引（路径或MD5Index），新版本的MD5会登记到索引中。
+    
+    Returns:
+        (输出文件名, 文件内容, MD5)，无法处理时返回None
+    """
+    if engine not in ENGINES or encoder not in ENCODER_PROFILES:
+        return None
+    if unique and index >= UNIQUE_MAX_VERSIONS:
+        return None
+    if filename is None:
+        filename = input_path if isinstance(input_path, (str, os.PathLike)) else 'image.jpg'
+    base_name = os.path.splitext(os.path.basename(filename))[0]
+    file_ext = os.path.splitext(filename)[1] or '.jpg'
+    output_filename = f"{base_name}_v{index+1:02d}{file_ext}"
+    md5_index = _resolve_index(md5_index)
+    
+    with tiling(max_tile_bytes):
+        try:
+            source_data, original_image = _load_image(input_path)
+        except Exception:
+            return None
+        if generated_md5s is None:
+            generated_md5s = set()
+        generated_md5s.add(hashlib.md5(source_data).hexdigest())
         
-        max_retries = 10  # 最多重试10次
-        retry_count = 0
-        success = False
+        try:
+            reserved = stamp_region(np.asarray(original_image, dtype=np.uint8)) if unique else None
+        except ValueError:
+            return None
         
-        while retry_count < max_retries and not success:
-            try:
-                # 组合应用多种修改方法
-                modified_image = original_image.copy()
-                current_seed = seed + retry_count * 1000
-                
-                for method_idx, method in enumerate(selected_methods):
-                    method_seed = current_seed + method_idx * 100
-                    modified_image = method(modified_image, method_seed)
-                
-                # 确保是RGB模式
-                if modified_image.mode != 'RGB':
-                    modified_image = modified_image.convert('RGB')
-                
-                # 生成输出文件名
-                output_filename = f"{base_name}_v{i+1:02d}{file_ext}"
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # 保存图片（使用不同的质量参数确保MD5不同）
-                quality = 95 + (i % 5) + (retry_count % 3)  # 质量在95-102之间变化
-                if file_ext.lower() in ['.jpg', '.jpeg']:
-                    modified_image.save(output_path, 'JPEG', quality=quality, optimize=True)
-                elif file_ext.lower() == '.png':
-                    modified_image.save(output_path, 'PNG', optimize=True)
-                else:
-                    modified_image.save(output_path)
-                
-                # 计算新文件的MD5
-                new_md5 = calculate_md5(output_path)
-                
-                # 检查MD5是否唯一
-                if new_md5 in generated_md5s:
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        # 如果重复，使用新的随机种子和更强的修改方法组合
-                        seed = random.randint(1, 999999)
-                        # 使用更多方法组合（3-5种）
-                        num_retry_methods = random.randint(3, 5)
-                        retry_methods = random.sample(MODIFICATION_METHODS, min(num_retry_methods, len(MODIFICATION_METHODS)))
-                        
-                        modified_image = original_image.copy()
-                        for method_idx, method in enumerate(retry_methods):
-                            method_seed = seed + method_idx * 100 + retry_count * 1000
-                            modified_image = method(modified_image, method_seed)
-                        
-                        if modified_image.mode != 'RGB':
-                            modified_image = modified_image.convert('RGB')
-                        continue
-                    else:
-                        print(f"警告: 版本 {i+1} 经过 {max_retries} 次尝试后仍可能重复MD5")
-                
-                # MD5唯一，成功
-                generated_md5s.add(new_md5)
-                version_count += 1
-                success = True
-                
-                file_size = os.path.getsize(output_path) / 1024  # KB
-                if retry_count > 0:
-                    print(f"✓ 版本 {i+1:2d}: {output_filename} (重试 {retry_count} 次)")
-                else:
-                    print(f"✓ 版本 {i+1:2d}: {output_filename}")
-                print(f"  MD5: {new_md5}")
-                print(f"  大小: {file_size:.2f} KB\n")
-                
-            except Exception as e:
-                retry_count += 1
-                if retry_count >= max_retries:
-                    print(f"✗ 生成版本 {i+1} 时出错: {e}\n")
-                    break
-                continue
+        rng, variant_seed, methods = variant_plan(seed, index)
+        first_image = None
+        if engine == 'batch':
+            first_image = next(iter_batch_images(np.asarray(original_image, dtype=np.uint8), [variant_seed]))
         
-        if not success:
-            continue
+        result = _generate_version(
+            original_image, index, variant_seed, methods, output_filename, file_ext, generated_md5s,
+            lambda name, data: None, rng, encoder, first_image=first_image, reserved=reserved,
+            md5_index=md5_index)
+    if result is None:
+        return None
+    return output_filename, result[3], result[0]
+
+
+# 单张图片少于该版本数时不启动进程池（启动子进程并导入模块的时间比生成这些版本还长）
+PARALLEL_MIN_VERSIONS = 8
+
+# 批处理模式支持的图片扩展名
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+# 生成的版本的文件名（不含扩展名）以_v加序号结尾，展开目录和通配符时跳过，避免重新运行时把上次的结果当作输入
+VARIANT_NAME = re.compile(r'_v\d{2,}$')
+
+# 批处理断点文件默认名称前缀（记录已完成的图片，中断后可继续），后面加上生成参数的摘要
+CHECKPOINT_FILENAME = '.md5_checkpoint'
+# 断点文件第一行记录生成参数，参数不同时不能继续
+CHECKPOINT_HEADER = '# options: '
+# 影响生成结果的参数及其默认值（与process_image相同）
+CHECKPOINT_OPTIONS = {'mode': 'pixel', 'engine': 'classic', 'encoder': DEFAULT_ENCODER, 'seed': None,
+                      'unique': False}
+
+
+def _is_generated(path, output_dir):
+    """path是否为之前生成的版本: 位于输出目录中，或文件名以_v加序号结尾"""
+    if output_dir and os.path.commonpath([os.path.abspath(path), output_dir]) == output_dir:
+        return True
+    return VARIANT_NAME.search(os.path.splitext(os.path.basename(path))[0]) is not None
+
+
+def collect_inputs(patterns, manifest=None, output_dir=None):
+    """
+    展开批处理输入：图片路径、目录（递归查找图片）、通配符以及清单文件
     
-    print(f"\n完成! 成功生成 {version_count} 个版本")
-    print(f"所有版本保存在: {os.path.abspath(output_dir)}")
-    print(f"共 {len(generated_md5s)} 个不同的MD5值")
-    print(f"\n作者：小杨 | 微信：Zi_ming1020 | 欢迎反馈")
+    清单文件每行一个路径，空行和#开头的行会被忽略。展开目录和通配符时跳过输出目录中的文件和
+    文件名以_v加序号结尾的文件（之前生成的版本，未指定输出目录时与原图在同一目录）；直接指定的路径不跳过。
+    返回去重后的绝对路径列表。
+    """
+    patterns = list(patterns)
+    if manifest:
+        with open(manifest, encoding='utf-8') as f:
+            patterns.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    output_dir = os.path.abspath(output_dir) if output_dir else None
+    
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                paths.extend(os.path.join(root, name) for name in sorted(files)
+                             if name.lower().endswith(IMAGE_EXTENSIONS)
+                             and not _is_generated(os.path.join(root, name), output_dir))
+        elif glob.has_magic(pattern):
+            paths.extend(p for p in sorted(glob.glob(pattern, recursive=True))
+                         if os.path.isfile(p) and not _is_generated(p, output_dir))
+        else:
+            paths.append(pattern)
+    
+    seen = set()
+    result = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if path not in seen:
+            seen.add(path)
+            result.append(path)
+    return result
+
+
+def checkpoint_options(output_dir, num_versions, options):
+    """断点文件记录的生成参数: 输出目录、版本数以及mode、engine、encoder、seed、unique"""
+    recorded = {'output_dir': os.path.abspath(output_dir) if output_dir else None, 'num_versions': num_versions}
+    recorded.update((key, options.get(key, default)) for key, default in CHECKPOINT_OPTIONS.items())
+    return recorded
+
+
+def default_checkpoint(output_dir, num_versions, options):
+    """
+    默认断点文件路径: 输出目录（未指定时为当前目录）下的.md5_checkpoint_<参数摘要>
+    
+    文件名包含生成参数的摘要，参数不同的批处理任务使用不同的断点文件，不会互相跳过图片。
+    """
+    recorded = json.dumps(checkpoint_options(output_dir, num_versions, options), sort_keys=True)
+    digest = hashlib.md5(recorded.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(output_dir or '.', f"{CHECKPOINT_FILENAME}_{digest}")
+
+
+def read_checkpoint(checkpoint, recorded):
+    """
+    读取断点文件中已完成的图片路径
+    
+    文件第一行记录的生成参数与recorded不同时抛出ValueError（按不同参数继续会跳过没有按新参数生成的图片）；
+    没有参数行的旧断点文件不做检查。文件不存在时返回空集合。
+    """
+    if not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint, encoding='utf-8') as f:
+        lines = [line.rstrip('\n') for line in f if line.strip()]
+    if lines and lines[0].startswith(CHECKPOINT_HEADER):
+        previous = json.loads(lines.pop(0)[len(CHECKPOINT_HEADER):])
+        changed = sorted(key for key in set(previous) | set(recorded) if previous.get(key) != recorded.get(key))
+        if changed:
+            details = ', '.join(f"{key}: {previous.get(key)!r} -> {recorded.get(key)!r}" for key in changed)
+            raise ValueError(f"断点文件 {checkpoint} 是用不同的参数生成的（{details}），"
+                             f"请使用相同的参数继续，或删除该文件/用--checkpoint指定其他文件重新开始")
+    return set(lines)
+
 
+def _process_batch_item(input_path, output_dir, num_versions, options, profile=False):
+    """批处理子进程: 静默处理单张图片，返回(生成版本数, 错误信息, 各阶段耗时或None)"""
+    log = io.StringIO()
+    stage_profile = StageProfile() if profile else None
+    with contextlib.redirect_stdout(log):
+        count = process_image(input_path, output_dir, num_versions, profile=stage_profile, **options)
+    stages = stage_profile.as_dict() if profile else None
+    if count is None:
+        errors = [line for line in log.getvalue().splitlines() if line.startswith('错误')]
+        return 0, errors[0] if errors else '处理失败', stages
+    return count, None, stages
 
-def main():
+
+def process_batch(input_paths, output_dir=None, num_versions=3, workers=1, checkpoint=None, profile=None,
+                  **options):
+    """
+    批量处理多张图片，多个进程同时处理不同的图片
+    
+    Args:
+        input_paths: 输入图片路径列表
+        output_dir: 输出目录，如果为None则使用各输入文件所在目录
+        num_versions: 每张图片要生成的版本数量
+        workers: 并行处理图片的进程数
+        checkpoint: 断点文件路径，已记录的图片会被跳过，为None时不记录；文件记录的生成参数不同时不处理
+        profile: StageProfile对象，指定后汇总所有图片各处理阶段的耗时和计数
+        options: 传给process_image的其他参数（engine等）
+    """
+    recorded = checkpoint_options(output_dir, num_versions, options)
+    done = set()
+    if checkpoint:
+        try:
+            done = read_checkpoint(checkpoint, recorded)
+        except ValueError as e:
+            print(f"错误: {e}")
+            return
+    
+    pending = [path for path in input_paths if path not in done]
+    total = len(pending)
+    skipped = len(input_paths) - total
+    print(f"共 {len(input_paths)} 张图片，待处理 {total} 张", end='')
+    print(f"（断点续传跳过 {skipped} 张）" if skipped else '')
+    print(f"使用 {workers} 个进程并行处理\n")
+    if not pending:
+        return
+    
+    checkpoint_file = open(checkpoint, 'a', encoding='utf-8') if checkpoint else None
+    if checkpoint_file and checkpoint_file.tell() == 0:
+        checkpoint_file.write(CHECKPOINT_HEADER + json.dumps(recorded, sort_keys=True, ensure_ascii=False) + '\n')
+        checkpoint_file.flush()
+    finished = 0
+    failed = 0
+    version_total = 0
+    start = time.perf_counter()
+    
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # 限制同时提交的任务数，避免十万级图片一次性占用大量内存
+            queue = iter(pending)
+            running = {}
+            for path in itertools.islice(queue, workers * 4):
+                running[executor.submit(_process_batch_item, path, output_dir, num_versions, options,
+                                        profile is not None)] = path
+            
+            while running:
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    path = running.pop(future)
+                    try:
+                        count, error, stages = future.result()
+                        if profile is not None:
+                            profile.merge(stages)
+                    except Exception as e:
+                        count, error = 0, str(e)
+                    
+                    finished += 1
+                    elapsed = time.perf_counter() - start
+                    if error is None:
+                        version_total += count
+                        if checkpoint_file:
+                            checkpoint_file.write(path + '\n')
+                            checkpoint_file.flush()
+                        print(f"✓ [{finished}/{total}] {os.path.basename(path)}: {count} 个版本 | "
+                              f"{finished / elapsed:.2f} 张/秒, {version_total / elapsed:.2f} 个版本/秒")
+                    else:
+                        failed += 1
+                        print(f"✗ [{finished}/{total}] {os.path.basename(path)}: {error}")
+                    
+                    next_path = next(queue, None)
+                    if next_path is not None:
+                        running[executor.submit(_process_batch_item, next_path, output_dir,
+                                                num_versions, options, profile is not None)] = next_path
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+    
+    elapsed = time.perf_counter() - start
+    print(f"\n批处理完成! 成功 {finished - failed} 张，失败 {failed} 张，共生成 {version_total} 个版本")
+    print(f"耗时 {elapsed:.1f} 秒，平均 {finished / elapsed:.2f} 张/秒, {version_total / elapsed:.2f} 个版本/秒")
+    if failed and checkpoint:
+        print(f"失败的图片未写入断点文件，重新运行即可重试: {checkpoint}")
+
+
+def seed_value(value):
+    """--seed参数: 非负整数（np.random.SeedSequence不接受负数）"""
+    seed = int(value)
+    if seed < 0:
+        raise argparse.ArgumentTypeError(f'随机种子必须是非负整数: {value}')
+    return seed
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description='图片MD5修改工具 - 生成多个不同MD5的图片版本',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -248,17 +1411,75 @@ def main():
   python image_md5_modifier.py image.jpg -n 5     # 生成5张
   python image_md5_modifier.py image.jpg -o output_folder
   python image_md5_modifier.py image.jpg -n 10    # 生成10张
+  python image_md5_modifier.py image.jpg -n 100 --engine batch   # 批量引擎
+  python image_md5_modifier.py image.jpg -n 100 -j 4              # 4个进程并行
+  python image_md5_modifier.py image.jpg -n 100 --mode container # 不解码像素，只插入附加数据
+  python image_md5_modifier.py photos/ -o output -j 0             # 批量处理整个目录
+  python image_md5_modifier.py "photos/**/*.png" --manifest list.txt -o output
+  python image_md5_modifier.py image.jpg -n 20 --profile          # 打印各阶段耗时
+  python image_md5_modifier.py scan.png --tile-memory 64           # 超大图片分块处理，限制内存
+  python image_md5_modifier.py image.jpg -n 5 --seed 42           # 固定种子，结果可重现
+  python image_md5_modifier.py image.png -n 20 --encoder fast     # 最快的编码配置
+  python image_md5_modifier.py image.jpg -n 50 --unique           # 写入版本标记，保证MD5不同且无需重试
+  python image_md5_modifier.py image.jpg -n 20 --md5-index        # 与之前所有批次生成的版本也不重复
 
 作者：小杨 | 微信：Zi_ming1020 | 欢迎反馈
         """
     )
-    parser.add_argument('input', help='输入图片路径')
+    parser.add_argument('input', nargs='*', help='输入图片路径、目录或通配符（可多个）')
+    parser.add_argument('--manifest', default=None, help='清单文件，每行一个图片路径')
     parser.add_argument('-o', '--output', default=None, help='输出目录（默认：与输入文件同目录）')
     parser.add_argument('-n', '--num', type=int, default=3, help='要生成的版本数量（默认：3）')
+    parser.add_argument('--mode', choices=MODES, default='pixel',
+                        help='生成模式：pixel修改像素，container只插入附加数据段，速度最快（默认：pixel）')
+    parser.add_argument('--engine', choices=ENGINES, default='classic',
+                        help='处理引擎：classic逐个处理，batch解码一次批量生成（默认：classic）')
+    parser.add_argument('--encoder', choices=ENCODERS, default=DEFAULT_ENCODER,
+                        help='编码配置：fast最快，balanced兼顾速度和大小，smallest文件最小（默认：balanced）')
+    parser.add_argument('--batch-memory', type=int, default=DEFAULT_BATCH_MEMORY // (1024 * 1024),
+                        help='batch引擎单批内存上限，单位MB（默认：512）')
+    parser.add_argument('--tile-memory', type=int, default=0,
+                        help='分块处理的临时内存上限，单位MB，超大图片逐条带添加噪声（默认：0，不分块）')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='并行进程数，0表示使用全部CPU核心（默认：1）')
+    parser.add_argument('--checkpoint', default=None,
+                        help=f'批处理断点文件（默认：输出目录或当前目录下的{CHECKPOINT_FILENAME}_<参数摘要>）')
+    parser.add_argument('--profile', action='store_true', help='处理完成后打印各阶段耗时统计')
+    parser.add_argument('--seed', type=seed_value, default=None,
+                        help='主随机种子，相同的图片、种子和参数总是生成相同的版本（默认：随机）')
+    parser.add_argument('--unique', action='store_true',
+                        help='唯一标记模式：把版本序号写入图片左上角（GIF写入调色板），保证各版本MD5不同，无需重试')
+    parser.add_argument('--md5-index', nargs='?', const=DEFAULT_INDEX_PATH, default=None, metavar='索引文件',
+                        help=f'使用全局MD5索引，保证与之前所有批次生成的版本都不重复（默认文件：{DEFAULT_INDEX_PATH}）')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if not args.input and not args.manifest:
+        parser.error('请指定输入图片路径、目录、通配符或--manifest清单文件')
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    options = {'mode': args.mode, 'engine': args.engine, 'encoder': args.encoder,
+               'max_batch_bytes': args.batch_memory * 1024 * 1024,
+               'max_tile_bytes': args.tile_memory * 1024 * 1024 or None, 'seed': args.seed, 'unique': args.unique,
+               'md5_index': args.md5_index}
+    profile = StageProfile() if args.profile else None
+    
+    # 单个图片文件: 多进程用于并行生成版本（版本数较少时直接在当前进程生成）；
+    # 否则进入批处理模式，多进程用于并行处理图片
+    if len(args.input) == 1 and not args.manifest and os.path.isfile(args.input[0]):
+        if args.num < PARALLEL_MIN_VERSIONS:
+            workers = 1
+        process_image(args.input[0], args.output, args.num, workers=workers, profile=profile, **options)
+        if profile is not None:
+            profile.summary()
+        return
     
-    process_image(args.input, args.output, args.num)
+    input_paths = collect_inputs(args.input, args.manifest, args.output)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    checkpoint = args.checkpoint or default_checkpoint(args.output, args.num, options)
+    process_batch(input_paths, args.output, args.num, workers=workers, checkpoint=checkpoint, profile=profile,
+                  **options)
+    if profile is not None:
+        profile.summary()
 
 
 if __name__ == '__main__':
@@ -5,17 +5,27 @@
 
 import os
 import sys
+import queue
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, scrolledtext
 import threading
-from image_md5_modifier import process_image
+from concurrent.futures import ThreadPoolExecutor
+from image_md5_modifier import DEFAULT_ENCODER, ENCODERS, PARALLEL_MIN_VERSIONS, iter_variants
+from md5_index import DEFAULT_INDEX_PATH
+
+
+# 界面每隔多少毫秒从消息队列取出日志和进度，每次最多处理多少条消息
+POLL_INTERVAL_MS = 100
+MAX_EVENTS_PER_POLL = 500
+# 日志窗口最多保留的行数
+MAX_LOG_LINES = 2000
 
 
 class ImageMD5ModifierGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("图片MD5修改工具")
-        self.root.geometry("600x500")
+        self.root.geometry("600x590")
         self.root.resizable(False, False)
         
         # 设置窗口图标（如果有的话）
@@ -28,9 +38,20 @@ class ImageMD5ModifierGUI:
         self.input_files = []  # 改为列表存储多个文件
         self.output_dir = tk.StringVar()
         self.num_versions = tk.IntVar(value=3)
+        self.encoder = tk.StringVar(value=DEFAULT_ENCODER)
+        self.use_md5_index = tk.BooleanVar(value=False)
         self.is_processing = False
         
+        # 后台线程只向消息队列发送消息，由界面定时器批量取出后更新日志和进度
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.file_progress = []  # 每个文件已完成的版本数
+        self.file_results = []  # 每个文件的(状态, 说明)，未完成时为None
+        self.versions_per_file = 0
+        
         self.create_widgets()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(POLL_INTERVAL_MS, self.poll_events)
         
     def create_widgets(self):
         # 标题
@@ -127,9 +148,33 @@ class ImageMD5ModifierGUI:
         
         tk.Label(num_frame, text="张", font=("微软雅黑", 10)).pack(side=tk.LEFT)
         
-        # 处理按钮
-        process_btn = tk.Button(
+        # 编码方式：fast最快，smallest文件最小
+        tk.Label(num_frame, text="编码:", font=("微软雅黑", 10)).pack(side=tk.LEFT, padx=(20, 0))
+        
+        encoder_combo = ttk.Combobox(
+            num_frame,
+            textvariable=self.encoder,
+            values=ENCODERS,
+            state="readonly",
+            width=10
+        )
+        encoder_combo.pack(side=tk.LEFT, padx=10)
+        
+        # 全局MD5索引：与之前所有批次（包括命令行和网页版）生成的版本都不重复
+        index_check = tk.Checkbutton(
             self.root,
+            text="全局去重（与之前生成过的所有版本都不重复）",
+            variable=self.use_md5_index,
+            font=("微软雅黑", 10)
+        )
+        index_check.pack(pady=(5, 0))
+        
+        # 处理和取消按钮
+        button_frame = tk.Frame(self.root)
+        button_frame.pack(pady=(20, 10))
+        
+        process_btn = tk.Button(
+            button_frame,
             text="开始处理",
             command=self.start_processing,
             font=("微软雅黑", 12, "bold"),
@@ -140,15 +185,29 @@ class ImageMD5ModifierGUI:
             pady=10,
             cursor="hand2"
         )
-        process_btn.pack(pady=20)
+        process_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.cancel_btn = tk.Button(
+            button_frame,
+            text="取消",
+            command=self.cancel_processing,
+            font=("微软雅黑", 12),
+            padx=20,
+            pady=10,
+            state=tk.DISABLED
+        )
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
         
-        # 进度条
+        # 进度条（按版本计算）
         self.progress = ttk.Progressbar(
             self.root,
-            mode='indeterminate',
+            mode='determinate',
             length=560
         )
-        self.progress.pack(pady=10, padx=20)
+        self.progress.pack(pady=(10, 0), padx=20)
+        
+        self.progress_label = tk.Label(self.root, text="", font=("微软雅黑", 9), fg="#666")
+        self.progress_label.pack()
         
         # 日志输出区域
         log_frame = tk.Frame(self.root)
@@ -186,23 +245,25 @@ class ImageMD5ModifierGUI:
         self.redirect_output()
         
     def redirect_output(self):
-        """重定向print输出到日志窗口"""
+        """重定向print输出到日志窗口（经消息队列，由界面定时器写入）"""
         class TextRedirector:
-            def __init__(self, text_widget, root):
-                self.text_widget = text_widget
-                self.root = root
+            """按整行把输出放入消息队列，可在任意线程中调用；各线程的未完成行分别缓存，不会互相穿插"""
+            
+            def __init__(self, events):
+                self.events = events
+                self.local = threading.local()
                 
             def write(self, string):
-                if string.strip():  # 只显示非空内容
-                    self.text_widget.insert(tk.END, string)
-                    self.text_widget.see(tk.END)
-                    self.root.update_idletasks()
+                *lines, self.local.pending = (getattr(self.local, 'pending', '') + string).split('\n')
+                for line in lines:
+                    if line.strip():  # 只显示非空内容
+                        self.events.put(('log', line))
                 
             def flush(self):
                 pass
         
-        sys.stdout = TextRedirector(self.log_text, self.root)
-        sys.stderr = TextRedirector(self.log_text, self.root)
+        sys.stdout = TextRedirector(self.events)
+        sys.stderr = TextRedirector(self.events)
         
     def browse_files(self):
         """浏览选择多个图片文件"""
@@ -258,55 +319,133 @@ class ImageMD5ModifierGUI:
         # 清空日志
         self.log_text.delete(1.0, tk.END)
         
-        # 在新线程中处理，避免界面卡顿
-        self.is_processing = True
-        self.progress.start()
-        
-        thread = threading.Thread(
-            target=self.process_images_thread,
-            args=(self.input_files.copy(), output_path, num_versions),
-            daemon=True
-        )
-        thread.start()
+        # 文件在线程池中并行处理；文件数少于CPU核心数时，每个文件再用多个进程并行生成版本
+        input_files = self.input_files.copy()
+        cpu_count = os.cpu_count() or 1
+        pool_size = min(len(input_files), cpu_count)
+        # 版本数较少时不启动进程池（与命令行相同），直接在处理该文件的线程中生成
+        version_workers = (max(1, cpu_count // len(input_files))
+                           if num_versions >= PARALLEL_MIN_VERSIONS else 1)
         
-    def process_images_thread(self, input_files, output_path, num_versions):
-        """在后台线程中处理多个图片"""
+        self.is_processing = True
+        self.cancel_event.clear()
+        self.versions_per_file = num_versions
+        self.file_progress = [0] * len(input_files)
+        self.file_results = [None] * len(input_files)
+        self.progress.config(maximum=len(input_files) * num_versions, value=0)
+        self.progress_label.config(text="")
+        self.cancel_btn.config(state=tk.NORMAL)
+        
+        executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="md5-worker")
+        for index, input_path in enumerate(input_files):
+            executor.submit(self.process_file, index, len(input_files), input_path, output_path, num_versions,
+                            self.encoder.get(), version_workers,
+                            DEFAULT_INDEX_PATH if self.use_md5_index.get() else None)
+        executor.shutdown(wait=False)
+        
+    def process_file(self, index, total, input_path, output_path, num_versions, encoder=DEFAULT_ENCODER,
+                     workers=1, md5_index=None):
+        """线程池中处理一个图片，每个版本完成后发送进度消息；取消后在当前版本完成时停止"""
+        name = os.path.basename(input_path)
+        if self.cancel_event.is_set():
+            self.events.put(('file', index, 'cancelled', name))
+            return
+        generated = 0
+        try:
+            print(f"\n[{index + 1}/{total}] 正在处理: {name}")
+            output_dir = output_path or os.path.dirname(input_path) or "."
+            variants = iter_variants(input_path, output_dir, num_versions, workers=workers, encoder=encoder,
+                                     md5_index=md5_index)
+            for result in variants:
+                generated += result.md5 is not None
+                self.events.put(('version', index))
+                if self.cancel_event.is_set():
+                    variants.close()
+                    self.events.put(('file', index, 'cancelled', f"{name}（已生成 {generated} 个版本）"))
+                    return
+            if generated == 0:
+                raise ValueError("没有成功生成任何版本")
+            print(f"✓ 完成: {name}（{generated} 个版本）")
+            self.events.put(('file', index, 'done', name))
+        except Exception as e:
+            print(f"✗ 失败: {name} - {str(e)}")
+            self.events.put(('file', index, 'error', f"{name}: {str(e)}"))
+            
+    def poll_events(self):
+        """定时批量取出消息队列中的日志和进度，合并为一次界面更新"""
+        lines = []
+        progress_changed = False
         try:
-            total = len(input_files)
-            success_count = 0
-            failed_files = []
+            for _ in range(MAX_EVENTS_PER_POLL):
+                event = self.events.get_nowait()
+                if event[0] == 'log':
+                    lines.append(event[1])
+                elif event[0] == 'version':
+                    self.file_progress[event[1]] += 1
+                    progress_changed = True
+                elif event[0] == 'file':
+                    _, index, status, detail = event
+                    # 失败或取消的文件剩余的版本也计入进度
+                    self.file_progress[index] = self.versions_per_file
+                    self.file_results[index] = (status, detail)
+                    progress_changed = True
+        except queue.Empty:
+            pass
+        
+        if lines:
+            self.append_log(lines)
+        if progress_changed and self.is_processing:
+            self.update_progress()
+        self.root.after(POLL_INTERVAL_MS, self.poll_events)
+        
+    def append_log(self, lines):
+        """一次性追加多行日志，超过MAX_LOG_LINES时删除最早的行"""
+        self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+        line_count = int(self.log_text.index('end-1c').split('.')[0])
+        if line_count > MAX_LOG_LINES:
+            self.log_text.delete('1.0', f'{line_count - MAX_LOG_LINES + 1}.0')
+        self.log_text.see(tk.END)
+        
+    def update_progress(self):
+        completed = sum(self.file_progress)
+        finished = sum(result is not None for result in self.file_results)
+        self.progress.config(value=completed)
+        self.progress_label.config(
+            text=f"已完成 {completed}/{self.versions_per_file * len(self.file_results)} 个版本，"
+                 f"{finished}/{len(self.file_results)} 个文件")
+        if finished == len(self.file_results):
+            self.processing_complete()
             
-            for i, input_path in enumerate(input_files, 1):
-                try:
-                    print(f"\n[{i}/{total}] 正在处理: {os.path.basename(input_path)}")
-                    process_image(input_path, output_path, num_versions)
-                    success_count += 1
-                    print(f"✓ 完成: {os.path.basename(input_path)}")
-                except Exception as e:
-                    failed_files.append((os.path.basename(input_path), str(e)))
-                    print(f"✗ 失败: {os.path.basename(input_path)} - {str(e)}")
+    def cancel_processing(self):
+        """请求取消：正在生成的版本完成后停止，尚未开始的文件直接跳过"""
+        if self.is_processing:
+            self.cancel_event.set()
+            self.cancel_btn.config(state=tk.DISABLED)
+            self.progress_label.config(text="正在取消，等待当前版本完成...")
             
-            # 处理完成
-            if failed_files:
-                msg = f"处理完成！成功: {success_count}/{total}\n失败的文件:\n" + "\n".join([f"  - {f[0]}: {f[1]}" for f in failed_files])
-            else:
-                msg = f"处理完成！成功处理 {success_count} 个文件。"
-            self.root.after(0, self.processing_complete, True, msg)
-        except Exception as e:
-            import traceback
-            error_msg = f"处理出错: {str(e)}\n{traceback.format_exc()}"
-            self.root.after(0, self.processing_complete, False, error_msg)
+    def on_close(self):
+        self.cancel_event.set()
+        self.root.destroy()
             
-    def processing_complete(self, success, message):
-        """处理完成回调"""
+    def processing_complete(self):
+        """所有文件处理结束后汇总结果"""
         self.is_processing = False
-        self.progress.stop()
-        
-        if success:
-            messagebox.showinfo("成功", message)
+        self.cancel_btn.config(state=tk.DISABLED)
+        
+        total = len(self.file_results)
+        done = [detail for status, detail in self.file_results if status == 'done']
+        failed = [detail for status, detail in self.file_results if status == 'error']
+        cancelled = [detail for status, detail in self.file_results if status == 'cancelled']
+        msg = f"处理完成！成功处理 {len(done)}/{total} 个文件。"
+        if failed:
+            msg += "\n失败的文件:\n" + "\n".join(f"  - {detail}" for detail in failed)
+        if cancelled:
+            msg += f"\n已取消 {len(cancelled)} 个文件。"
+        
+        if failed and not done:
+            messagebox.showerror("错误", msg)
         else:
-            messagebox.showerror("错误", message)
-
+            messagebox.showinfo("完成", msg)
 
 def main():
     root = tk.Tk()
@@ -0,0 +1,592 @@
+"""
+图片MD5修改工具 - 网页版压力测试
+在本地启动app.py（开发服务器以及gunicorn/waitress等生产WSGI服务器），用合成图片模拟多个并发客户端上传、
+查询进度和下载，统计吞吐量、延迟分位数、错误率以及服务器进程的CPU和内存，结果保存为JSON并可与基线对比
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+import importlib.util
+
+from benchmark import FORMAT_EXTENSIONS, encode_source, parse_list, synthetic_image
+
+try:
+    import psutil
+except ImportError:  # 没有psutil时在Linux上读取/proc，其他系统不采样服务器资源
+    psutil = None
+
+
+# 支持的服务器: 名称 -> 需要的模块；启动命令见server_command
+SERVERS = {
+    'dev': None,
+    'gunicorn': 'gunicorn',
+    'waitress': 'waitress',
+}
+
+# 客户端的操作及默认权重: upload上传并等待处理完成，其余操作下载已完成会话中的文件
+OPERATIONS = ('upload', 'download_all', 'download_file', 'thumb', 'download_zip')
+DEFAULT_MIX = 'upload=2,download_all=2,download_file=6,thumb=4,download_zip=1'
+
+# 客户端区分请求来源的请求头（启动服务器时设置CLIENT_HEADER），使每个虚拟客户端分别计入准入控制的限额
+CLIENT_HEADER = 'X-Load-Client'
+
+# 对比基线时使用的指标: 名称 -> 越大越好(True)还是越小越好(False)
+COMPARED_METRICS = {'throughput': True, 'p95': False}
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(server, port, threads):
+    """
+    启动服务器的命令
+    
+    后台任务的状态保存在进程内存中，生产服务器只能使用一个进程（多线程），否则查询进度可能落到别的进程上。
+    """
+    if server == 'dev':
+        return [sys.executable, os.path.join(APP_DIR, 'app.py')]
+    if server == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', '--workers', '1', '--worker-class', 'gthread',
+                '--threads', str(threads), '--bind', f'127.0.0.1:{port}', 'app:app']
+    return [sys.executable, '-m', 'waitress', f'--listen=127.0.0.1:{port}', f'--threads={threads}', 'app:app']
+
+
+def start_server(server, port, threads, workdir, extra_env):
+    """在workdir中启动服务器（上传、输出和缓存目录都在其中），返回(进程, 日志文件路径)"""
+    env = dict(os.environ, PORT=str(port), CLIENT_HEADER=CLIENT_HEADER, PYTHONUNBUFFERED='1')
+    env['PYTHONPATH'] = APP_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    env.update(extra_env)
+    log_path = os.path.join(workdir, f'{server}.log')
+    with open(log_path, 'wb') as log:
+        process = subprocess.Popen(server_command(server, port, threads), cwd=workdir, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+    return process, log_path
+
+
+def wait_ready(port, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/')
+            ready = connection.getresponse().status == 200
+            connection.close()
+            if ready:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+class ResourceSampler:
+    """定期采样服务器进程（包括子进程）的CPU占用和内存（RSS）"""
+    
+    def __init__(self, pid, interval):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []  # [{'t', 'cpu_percent', 'rss_bytes'}]
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+        self.clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+    
+    @property
+    def available(self):
+        return psutil is not None or os.path.exists(f'/proc/{self.pid}/stat')
+    
+    def _proc_tree(self):
+        """Linux: 服务器进程及其所有子进程的(累计CPU秒数, RSS字节数)"""
+        stats = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            # fields[0]为状态，之后依次为ppid(1)、utime(11)、stime(12)、rss页数(21)
+            stats[int(entry)] = (int(fields[1]), (int(fields[11]) + int(fields[12])) / self.clock_ticks,
+                                 int(fields[21]) * self.page_size)
+        pids = {self.pid}
+        changed = True
+        while changed:
+            children = {pid for pid, (ppid, _, _) in stats.items() if ppid in pids} - pids
+            changed = bool(children)
+            pids |= children
+        return (sum(stats[pid][1] for pid in pids if pid in stats),
+                sum(stats[pid][2] for pid in pids if pid in stats))
+    
+    def _psutil_tree(self):
+        process = psutil.Process(self.pid)
+        cpu = rss = 0
+        for proc in [process] + process.children(recursive=True):
+            try:
+                times = proc.cpu_times()
+                cpu += times.user + times.system
+                rss += proc.memory_info().rss
+            except psutil.Error:
+                pass
+        return cpu, rss
+    
+    def read(self):
+        return self._psutil_tree() if psutil is not None else self._proc_tree()
+    
+    def _run(self):
+        start = time.perf_counter()
+        last_time, last_cpu = start, self.read()[0]
+        while not self.stopped.wait(self.interval):
+            try:
+                cpu, rss = self.read()
+            except Exception:
+                break  # 服务器进程已退出
+            now = time.perf_counter()
+            self.samples.append({
+                't': round(now - start, 3),
+                'cpu_percent': round((cpu - last_cpu) / (now - last_time) * 100, 1),
+                'rss_bytes': rss,
+            })
+            last_time, last_cpu = now, cpu
+    
+    def start(self):
+        if self.available:
+            self.thread.start()
+    
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+    
+    def summary(self):
+        if not self.samples:
+            return None
+        cpu = [sample['cpu_percent'] for sample in self.samples]
+        return {
+            'cpu_percent_mean': round(sum(cpu) / len(cpu), 1),
+            'cpu_percent_max': max(cpu),
+            'rss_bytes_max': max(sample['rss_bytes'] for sample in self.samples),
+            'rss_bytes_last': self.samples[-1]['rss_bytes'],
+        }
+
+
+def multipart(fields, files):
+    """编码multipart/form-data请求体，files为[(字段名, 文件名, 内容)]，返回(请求体, Content-Type)"""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+        body.write(data)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+class Recorder:
+    """线程安全地记录每个请求的(操作, 开始时间, 耗时, 结果)，结果为ok、rejected或error"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+        self.status_codes = {}
+    
+    def add(self, operation, start, seconds, outcome, status=None, nbytes=0):
+        with self.lock:
+            self.records.append((operation, start, seconds, outcome, nbytes))
+            key = str(status) if status is not None else 'exception'
+            self.status_codes[key] = self.status_codes.get(key, 0) + 1
+    
+    def add_job(self, start, seconds, outcome):
+        """记录一次从上传到处理完成的总耗时（不是单个请求，不计入状态码统计）"""
+        with self.lock:
+            self.records.append(('job', start, seconds, outcome, 0))
+
+
+class Client:
+    """
+    一个虚拟客户端: 按权重随机选择操作，循环直到测试结束
+    
+    使用一个保持连接的HTTP连接；收到429时按Retry-After等待后继续（与网页的行为一致）。
+    上传后轮询/status直到处理完成，再把该会话加入可下载的会话列表；job操作记录从上传到处理完成的总耗时。
+    """
+    
+    def __init__(self, index, port, images, mix, num_versions, recorder, deadline, poll_interval, seed):
+        self.client_id = f'client-{index}'
+        self.port = port
+        self.images = images
+        self.operations = [operation for operation, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.num_versions = num_versions
+        self.recorder = recorder
+        self.deadline = deadline
+        self.poll_interval = poll_interval
+        self.rng = random.Random(seed)
+        self.connection = None
+        self.sessions = []  # [(session_id, [文件信息])]
+    
+    def request(self, method, path, body=None, headers=None):
+        """发送请求，返回(状态码, 响应头, 响应体)；连接断开时重新连接一次"""
+        headers = dict(headers or {}, **{CLIENT_HEADER: self.client_id})
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.connection.close()
+                    self.connection = None
+                return response.status, response, data
+            except (OSError, http.client.HTTPException):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+    
+    def timed(self, operation, method, path, body=None, headers=None):
+        """发送请求并记录耗时，返回(状态码, 响应, 响应体)，出错时返回(None, None, None)"""
+        start = time.perf_counter()
+        try:
+            status, response, data = self.request(method, path, body, headers)
+        except (OSError, http.client.HTTPException):
+            self.recorder.add(operation, start, time.perf_counter() - start, 'error')
+            return None, None, None
+        if status in (413, 429, 503):
+            outcome = 'rejected'
+        elif status >= 400:
+            outcome = 'error'
+        else:
+            outcome = 'ok'
+        self.recorder.add(operation, start, time.perf_counter() - start, outcome, status, len(data))
+        return status, response, data
+    
+    def backoff(self, response):
+        retry_after = response.getheader('Retry-After') if response is not None else None
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else 1.0
+        time.sleep(max(0.0, min(delay, self.deadline - time.time())))
+    
+    def upload(self):
+        filename, data = self.rng.choice(self.images)
+        body, content_type = multipart({'num_versions': self.num_versions}, [('file', filename, data)])
+        start = time.perf_counter()
+        status, response, payload = self.timed('upload', 'POST', '/upload', body, {'Content-Type': content_type})
+        if status != 202:
+            if status in (429, 503):
+                self.backoff(response)
+            return
+        session_id = json.loads(payload)['session_id']
+        
+        while time.time() < self.deadline:
+            time.sleep(self.poll_interval)
+            status, _, payload = self.timed('status', 'GET', f'/status/{session_id}')
+            if status != 200:
+                break
+            summary = json.loads(payload)
+            if summary['status'] in ('done', 'error'):
+                outcome = 'ok' if summary['status'] == 'done' else 'error'
+                self.recorder.add_job(start, time.perf_counter() - start, outcome)
+                if outcome == 'ok':
+                    self.list_files(session_id)
+                return
+    
+    def list_files(self, session_id, operation='download_all'):
+        status, _, payload = self.timed(operation, 'GET', f'/download_all/{session_id}')
+        if status == 200:
+            files = json.loads(payload).get('files', [])
+            self.sessions = [entry for entry in self.sessions if entry[0] != session_id] + [(session_id, files)]
+        elif status == 404:
+            self.sessions = [entry for entry in self.sessions if entry[0] != session_id]
+    
+    def run(self):
+        while time.time() < self.deadline:
+            operation = self.rng.choices(self.operations, self.weights)[0]
+            if operation == 'upload' or not self.sessions:
+                self.upload()
+                continue
+            session_id, files = self.rng.choice(self.sessions)
+            if operation == 'download_all':
+                self.list_files(session_id)
+            elif operation == 'download_zip':
+                self.timed(operation, 'GET', f'/download_zip/{session_id}')
+            elif files:
+                file = self.rng.choice(files)
+                self.timed(operation, 'GET', file['url'] if operation == 'download_file' else file['thumb_url'])
+        if self.connection is not None:
+            self.connection.close()
+
+
+def percentile(sorted_values, fraction):
+    """线性插值的分位数，sorted_values已排序"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(records, duration):
+    """按操作汇总: 请求数、吞吐量（成功请求/秒）、错误率、被拒绝率、延迟分位数（毫秒，只统计成功请求）"""
+    operations = {}
+    for operation, _, seconds, outcome, nbytes in records:
+        entry = operations.setdefault(operation, {'latencies': [], 'ok': 0, 'rejected': 0, 'error': 0, 'bytes': 0})
+        entry[outcome] += 1
+        entry['bytes'] += nbytes
+        if outcome == 'ok':
+            entry['latencies'].append(seconds)
+    
+    result = {}
+    for operation, entry in sorted(operations.items()):
+        latencies = sorted(entry.pop('latencies'))
+        count = entry['ok'] + entry['rejected'] + entry['error']
+        result[operation] = {
+            'requests': count,
+            'ok': entry['ok'],
+            'throughput': round(entry['ok'] / duration, 3),
+            'error_rate': round(entry['error'] / count, 4),
+            'rejected_rate': round(entry['rejected'] / count, 4),
+            'bytes_per_s': round(entry['bytes'] / duration),
+        }
+        for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            value = percentile(latencies, fraction)
+            result[operation][name] = round(value * 1000, 2) if value is not None else None
+        result[operation]['max'] = round(latencies[-1] * 1000, 2) if latencies else None
+    return result
+
+
+def run_server(server, args, images, mix):
+    """启动一种服务器并运行压力测试，返回结果；缺少依赖或启动失败时返回{'skipped': 原因}"""
+    module = SERVERS[server]
+    if module is not None and importlib.util.find_spec(module) is None:
+        return {'skipped': f'未安装{module}（pip install {module}）'}
+    if server == 'gunicorn' and os.name == 'nt':
+        return {'skipped': 'gunicorn不支持Windows'}
+    
+    workdir = tempfile.mkdtemp(prefix=f'md5-loadtest-{server}-')
+    port = free_port()
+    process, log_path = start_server(server, port, args.threads, workdir, dict(args.env))
+    try:
+        if not wait_ready(port, process):
+            with open(log_path, encoding='utf-8', errors='replace') as f:
+                log_tail = f.read()[-2000:]
+            return {'skipped': '服务器启动失败', 'log': log_tail}
+        
+        sampler = ResourceSampler(process.pid, args.sample_interval)
+        sampler.start()
+        recorder = Recorder()
+        deadline = time.time() + args.duration
+        clients = [Client(index, port, images, mix, args.num, recorder, deadline, args.poll_interval,
+                          args.seed * 1000 + index) for index in range(args.clients)]
+        threads = [threading.Thread(target=client.run, name=f'load-client-{index}', daemon=True)
+                   for index, client in enumerate(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+        sampler.stop()
+    finally:
+        stop_server(process)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    operations = summarize(recorder.records, duration)
+    requests = [record for record in recorder.records if record[0] != 'job']
+    errors = sum(1 for record in requests if record[3] == 'error')
+    return {
+        'duration': round(duration, 3),
+        'requests': len(requests),
+        'throughput': round(sum(1 for record in requests if record[3] == 'ok') / duration, 3),
+        'error_rate': round(errors / len(requests), 4) if requests else None,
+        'status_codes': recorder.status_codes,
+        'operations': operations,
+        'resources': sampler.summary(),
+        'samples': sampler.samples,
+    }
+
+
+def print_result(server, result):
+    if 'skipped' in result:
+        print(f"\n[{server}] 跳过: {result['skipped']}")
+        return
+    print(f"\n[{server}] {result['duration']:.1f} 秒，{result['requests']} 个请求，"
+          f"{result['throughput']:.1f} 请求/秒，错误率 {result['error_rate']:.2%}")
+    print(f"  {'操作':<14} {'请求数':>6} {'请求/秒':>8} {'错误率':>7} {'拒绝率':>7} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for operation, entry in result['operations'].items():
+        latencies = ' '.join(f"{entry[name]:9.1f}" if entry[name] is not None else f"{'-':>9}"
+                             for name in ('p50', 'p95', 'p99'))
+        print(f"  {operation:<14} {entry['requests']:>6} {entry['throughput']:>8.2f} {entry['error_rate']:>7.2%} "
+              f"{entry['rejected_rate']:>7.2%} {latencies}")
+    resources = result['resources']
+    if resources is not None:
+        print(f"  服务器CPU 平均 {resources['cpu_percent_mean']:.0f}% 最高 {resources['cpu_percent_max']:.0f}%，"
+              f"内存最高 {resources['rss_bytes_max'] / 1024 / 1024:.1f} MB")
+
+
+def compare(results, baseline, threshold):
+    """与基线对比，返回吞吐量下降或p95延迟上升超过threshold的[(指标名, 基线值, 当前值, 变化比例)]"""
+    regressions = []
+    for server, result in sorted(results.items()):
+        base_result = baseline.get('results', {}).get(server, {})
+        for operation, entry in sorted(result.get('operations', {}).items()):
+            base_entry = base_result.get('operations', {}).get(operation)
+            if base_entry is None:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                old, new = base_entry.get(metric), entry.get(metric)
+                if not old or new is None:
+                    continue
+                change = new / old - 1
+                if (-change if higher_is_better else change) > threshold:
+                    regressions.append((f"{server}:{operation}:{metric}", old, new, change))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(value):
+    mix = []
+    for item in parse_list(value):
+        operation, _, weight = item.partition('=')
+        if operation not in OPERATIONS:
+            raise ValueError(f'未知操作: {operation}（可选: {", ".join(OPERATIONS)}）')
+        mix.append((operation, float(weight or 1)))
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='图片MD5修改工具 - 网页版压力测试',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+示例用法:
+  python loadtest.py                                       # 开发服务器，8个客户端，30秒
+  python loadtest.py --servers dev,gunicorn,waitress --clients 16 --duration 60 -o load.json
+  python loadtest.py --sizes 0.5,4 --formats JPEG,PNG --mix upload=1,download_file=10
+  python loadtest.py --env JOB_WORKERS=4 --env OUTPUT_STORE=memory -o new.json --baseline load.json
+
+操作: {', '.join(OPERATIONS)}（默认权重: {DEFAULT_MIX}）
+        """
+    )
+    parser.add_argument('--servers', default='dev', help=f'要测试的服务器，逗号分隔（可选: {",".join(SERVERS)}，默认：dev）')
+    parser.add_argument('--clients', type=int, default=8, help='并发客户端数（默认：8）')
+    parser.add_argument('--duration', type=float, default=30, help='每种服务器的测试时长，单位秒（默认：30）')
+    parser.add_argument('--threads', type=int, default=8, help='生产服务器的线程数（默认：8）')
+    parser.add_argument('--sizes', default='0.5,2', help='上传图片的尺寸，单位百万像素，逗号分隔（默认：0.5,2）')
+    parser.add_argument('--formats', default='JPEG,PNG', help='上传图片的格式，逗号分隔（默认：JPEG,PNG）')
+    parser.add_argument('-n', '--num', type=int, default=3, help='每次上传生成的版本数量（默认：3）')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='各操作的权重，例如upload=1,download_file=5')
+    parser.add_argument('--env', action='append', default=[], metavar='名称=值',
+                        help='传给服务器的环境变量（可多次指定），例如JOB_WORKERS=4')
+    parser.add_argument('--poll-interval', type=float, default=0.2, help='上传后查询进度的间隔，单位秒（默认：0.2）')
+    parser.add_argument('--sample-interval', type=float, default=1.0, help='采样服务器CPU和内存的间隔，单位秒（默认：1）')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子，决定合成图片和各客户端的操作顺序（默认：0）')
+    parser.add_argument('--keep', action='store_true', help='保留服务器的工作目录和日志')
+    parser.add_argument('-o', '--output', default=None, help='结果JSON文件')
+    parser.add_argument('--baseline', default=None, help='基线JSON文件，用于对比')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='吞吐量下降或p95延迟上升的比例达到该值时视为性能回退（默认：0.10）')
+    
+    args = parser.parse_args()
+    servers = parse_list(args.servers)
+    for server in servers:
+        if server not in SERVERS:
+            parser.error(f'不支持的服务器: {server}')
+    formats = [fmt.upper() for fmt in parse_list(args.formats)]
+    for fmt in formats:
+        if fmt not in FORMAT_EXTENSIONS:
+            parser.error(f'不支持的格式: {fmt}')
+    try:
+        mix = parse_mix(args.mix)
+        args.env = [tuple(item.split('=', 1)) for item in args.env]
+    except ValueError as e:
+        parser.error(str(e))
+    if any(len(item) != 2 for item in args.env):
+        parser.error('--env的格式为 名称=值')
+    
+    # 合成图片只生成一次，各服务器使用相同的图片
+    images = []
+    for index, megapixels in enumerate(parse_list(args.sizes, float)):
+        image = synthetic_image(megapixels, 'RGB', seed=args.seed + index)
+        for fmt in formats:
+            images.append((f'load_{megapixels:g}mp{FORMAT_EXTENSIONS[fmt]}', encode_source(image, fmt)))
+    print(f"合成图片: {', '.join(f'{name} ({len(data) / 1024:.0f} KB)' for name, data in images)}")
+    print(f"{args.clients} 个客户端，每种服务器 {args.duration:g} 秒，操作权重: {args.mix}")
+    
+    results = {}
+    for server in servers:
+        print(f"\n正在测试: {server} ...")
+        results[server] = run_server(server, args, images, mix)
+        print_result(server, results[server])
+    
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': dict(vars(args), env=dict(args.env)),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存: {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n发现 {len(regressions)} 项性能回退（阈值 {args.threshold:.0%}）:")
+            for name, old, new, change in regressions:
+                print(f"  {name:<40} {old:.2f} -> {new:.2f}  ({change:+.0%})")
+            sys.exit(1)
+        print(f"\n与基线相比没有超过 {args.threshold:.0%} 的性能回退")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+图片MD5修改工具 - 全局MD5索引
+持久化记录所有生成过的版本的MD5，命令行、图形界面和网页版共用，保证不同批次、不同会话之间也不会重复
+"""
+
+import os
+import sys
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+import functools
+import numpy as np
+
+
+# 默认的索引文件
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.image_md5_index.db')
+
+# 布隆过滤器每条记录占用的位数和哈希函数个数（误判率约0.05%），位数组大小取2的幂
+BLOOM_BITS_PER_ENTRY = 16
+BLOOM_HASHES = 11
+BLOOM_MIN_BITS = 1 << 20
+
+
+class BloomFilter:
+    """
+    以MD5本身作为哈希值的布隆过滤器
+    
+    MD5已经是均匀分布的随机值，直接取前后8字节作为两个哈希值，按h1 + i*h2得到各个位置，无需再计算哈希。
+    """
+    
+    def __init__(self, num_bits, num_hashes=BLOOM_HASHES):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(num_bits // 8)
+    
+    @classmethod
+    def for_entries(cls, count):
+        """按预计的记录数创建，预留一倍的增长空间"""
+        num_bits = BLOOM_MIN_BITS
+        while num_bits < count * BLOOM_BITS_PER_ENTRY * 2:
+            num_bits *= 2
+        return cls(num_bits)
+    
+    @property
+    def capacity(self):
+        return self.num_bits // BLOOM_BITS_PER_ENTRY
+    
+    def _positions(self, digest):
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        mask = self.num_bits - 1
+        return [(h1 + i * h2) & mask for i in range(self.num_hashes)]
+    
+    def add(self, digest):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+    
+    def add_many(self, digests):
+        """批量加入（NumPy向量化，与add的位置计算一致），用于启动时载入大量记录"""
+        if not digests:
+            return
+        hashes = np.frombuffer(b''.join(digests), dtype='<u8').reshape(-1, 2)
+        h1, h2 = hashes[:, 0], hashes[:, 1] | np.uint64(1)
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        mask = np.uint64(self.num_bits - 1)
+        for i in range(self.num_hashes):
+            positions = (h1 + np.uint64(i) * h2) & mask
+            np.bitwise_or.at(bits, (positions >> np.uint64(3)).astype(np.intp),
+                             np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+    
+    def __contains__(self, digest):
+        return all(self.bits[position >> 3] >> (position & 7) & 1 for position in self._positions(digest))
+
+
+class MD5Index:
+    """
+    保存在SQLite数据库中的MD5索引（线程安全，多个进程可同时写入）
+    
+    数据库使用WAL模式，读写互不阻塞。查询先经过内存中的布隆过滤器，绝大多数不存在的MD5
+    无需访问数据库即可确认；其他进程新写入的记录通过PRAGMA data_version发现并增量加入过滤器。
+    add用INSERT OR IGNORE原子地登记，多个进程同时登记同一个MD5时只有一个成功；过滤器确认已存在的MD5不再写入。
+    记录数在内存中维护，len()无需扫描数据库（其他进程用discard删除的记录不会反映在本进程的记录数中）。
+    ID使用AUTOINCREMENT，删除的ID不会被重新使用，否则其他进程重用已载入范围内的ID时不会被加入过滤器。
+    """
+    
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS md5s ('
+                          'id INTEGER PRIMARY KEY AUTOINCREMENT, digest BLOB NOT NULL UNIQUE, created REAL NOT NULL)')
+        self.bloom = None
+        self.count = 0  # 过滤器中的记录数
+        self.last_id = 0  # 已载入过滤器的最大记录ID
+        self.own_ids = set()  # 自己写入的、ID大于last_id的记录（下次载入时不重复计数）
+        self.data_version = None
+        with self.lock:
+            self._sync()
+    
+    def _load(self, after_id):
+        rows = self.conn.execute('SELECT id, digest FROM md5s WHERE id > ? ORDER BY id', (after_id,)).fetchall()
+        self.bloom.add_many([digest for _, digest in rows])
+        self.count += sum(1 for row_id, _ in rows if row_id not in self.own_ids)
+        self.own_ids.difference_update(row_id for row_id, _ in rows)
+        if rows:
+            self.last_id = rows[-1][0]
+    
+    def _sync(self):
+        """载入其他进程新写入的记录，记录数超过过滤器容量时重建（调用者持有锁）"""
+        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == self.data_version:
+            return
+        self.data_version = version
+        if self.bloom is None:
+            total = self.conn.execute('SELECT COUNT(*) FROM md5s').fetchone()[0]
+            self.bloom = BloomFilter.for_entries(total)
+        self._load(self.last_id)
+        if self.count > self.bloom.capacity:
+            self._rebuild()
+    
+    def _rebuild(self):
+        self.bloom = BloomFilter.for_entries(self.count)
+        self.count = self.last_id = 0
+        self.own_ids.clear()
+        self._load(0)
+    
+    def _exists(self, digest):
+        """先查布隆过滤器，可能存在时才查询数据库（调用者持有锁并已同步）"""
+        if digest not in self.bloom:
+            return False
+        return self.conn.execute('SELECT 1 FROM md5s WHERE digest = ?', (digest,)).fetchone() is not None
+    
+    def __contains__(self, md5):
+        digest = bytes.fromhex(md5)
+        with self.lock:
+            self._sync()
+            return self._exists(digest)
+    
+    def add(self, md5):
+        """登记一个MD5，返回True；已存在（包括其他进程刚刚写入的）时返回False"""
+        digest = bytes.fromhex(md5)
+        with self.lock:
+            self._sync()
+            if self._exists(digest):
+                return False
+            cursor = self.conn.execute('INSERT OR IGNORE INTO md5s (digest, created) VALUES (?, ?)',
+                                       (digest, time.time()))
+            # 自己写入的记录直接加入过滤器；中间没有未载入的ID时推进last_id，否则记下，
+            # 其他进程并发写入的较小ID在下次同步时载入，自己的记录不重复计数
+            self.bloom.add(digest)
+            if cursor.rowcount != 1:
+                return False
+            if cursor.lastrowid == self.last_id + 1:
+                self.last_id = cursor.lastrowid
+            else:
+                self.own_ids.add(cursor.lastrowid)
+            self.count += 1
+            if self.count > self.bloom.capacity:
+                self._rebuild()
+            return True
+    
+    def discard(self, md5):
+        """删除登记的MD5（登记后文件保存失败时），布隆过滤器中的位保留，只会多一次数据库查询"""
+        digest = bytes.fromhex(md5)
+        with self.lock:
+            row = self.conn.execute('SELECT id FROM md5s WHERE digest = ?', (digest,)).fetchone()
+            if row is None:
+                return
+            self.conn.execute('DELETE FROM md5s WHERE id = ?', (row[0],))
+            if row[0] <= self.last_id or row[0] in self.own_ids:
+                self.own_ids.discard(row[0])
+                self.count -= 1
+    
+    def add_many(self, md5s):
+        """在一个事务中批量登记，返回新登记的数量"""
+        now = time.time()
+        rows = [(bytes.fromhex(md5), now) for md5 in md5s]
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.executemany('INSERT OR IGNORE INTO md5s (digest, created) VALUES (?, ?)', rows)
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            added = self.conn.total_changes - before
+            # 新记录（以及其他进程并发写入的记录）按ID载入过滤器并计数
+            self._load(self.last_id)
+            if self.count > self.bloom.capacity:
+                self._rebuild()
+            return added
+    
+    def __len__(self):
+        with self.lock:
+            self._sync()
+            return self.count
+    
+    def stats(self):
+        return {
+            'path': self.path,
+            'entries': len(self),
+            'bloom_bytes': len(self.bloom.bits),
+        }
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+@functools.lru_cache(maxsize=None)
+def _open_index(path):
+    return MD5Index(path)
+
+
+def open_index(path=DEFAULT_INDEX_PATH):
+    """打开索引文件，同一进程中相同路径共用一个MD5Index（及其布隆过滤器）"""
+    return _open_index(os.path.abspath(os.path.expanduser(path)))
+
+
+def _file_md5(path):
+    hash_md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hash_md5.update(chunk)
+    return hash_md5.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='图片MD5修改工具 - 全局MD5索引',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例用法:
+  python md5_index.py --stats                        # 查看默认索引的记录数
+  python md5_index.py --import outputs/ old_outputs/ # 把已有的输出文件登记到索引（只需一次）
+  python md5_index.py --check image.jpg              # 检查文件的MD5是否已经生成过
+        """
+    )
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH, help=f'索引文件（默认：{DEFAULT_INDEX_PATH}）')
+    parser.add_argument('--import', dest='import_paths', nargs='+', default=[], metavar='路径',
+                        help='登记文件或目录（递归）中所有文件的MD5')
+    parser.add_argument('--check', nargs='+', default=[], metavar='文件',
+                        help='检查文件的MD5是否已在索引中（有已存在的文件时退出码为1）')
+    parser.add_argument('--stats', action='store_true', help='显示索引的记录数')
+    
+    args = parser.parse_args()
+    index = open_index(args.index)
+    
+    if args.import_paths:
+        files = []
+        for path in args.import_paths:
+            if os.path.isdir(path):
+                files.extend(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+            else:
+                files.append(path)
+        added = index.add_many(_file_md5(path) for path in files)
+        print(f"已扫描 {len(files)} 个文件，新登记 {added} 个MD5")
+    
+    found = False
+    for path in args.check:
+        md5 = _file_md5(path)
+        exists = md5 in index
+        found |= exists
+        print(f"{'已存在' if exists else '未生成过'}: {path} ({md5})")
+    
+    if args.stats or not (args.import_paths or args.check):
+        stats = index.stats()
+        print(f"索引文件: {stats['path']}")
+        print(f"记录数: {stats['entries']}")
+    
+    if found:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+图片MD5修改工具 - 运行指标
+网页版的计数器、仪表和直方图，以Prometheus文本格式输出（不依赖prometheus_client）
+"""
+
+import threading
+
+
+# 直方图默认分桶上限（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Metric:
+    """按标签值分组保存数据的指标，子类实现_new_value和_samples"""
+    
+    kind = None
+    
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}  # 标签值元组 -> 数据
+    
+    def _get(self, label_values):
+        value = self.values.get(label_values)
+        if value is None:
+            value = self.values[label_values] = self._new_value()
+        return value
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.extend(self._samples(label_values, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+    
+    def _new_value(self):
+        return [0.0]
+    
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self._get(label_values)[0] += amount
+    
+    def _samples(self, label_values, value):
+        return [f'{self.name}{_format_labels(self.labels, label_values)} {_format_value(value[0])}']
+
+
+class Gauge(Metric):
+    """取值时调用回调函数的仪表，适合队列长度、占用空间等当前状态"""
+    
+    kind = 'gauge'
+    
+    def __init__(self, name, help_text, callback):
+        super().__init__(name, help_text)
+        self.callback = callback
+    
+    def render(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}',
+                f'{self.name} {_format_value(self.callback())}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+    
+    def _new_value(self):
+        return {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+    
+    def observe(self, amount, *label_values):
+        with self.lock:
+            value = self._get(label_values)
+            for index, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    value['counts'][index] += 1
+                    break
+            value['sum'] += amount
+            value['count'] += 1
+    
+    def _samples(self, label_values, value):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, value['counts']):
+            cumulative += count
+            labels = _format_labels(self.labels, label_values, [f'le="{_format_value(bound)}"'])
+            samples.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labels, label_values)
+        samples.append(f'{self.name}_sum{labels} {_format_value(value["sum"])}')
+        samples.append(f'{self.name}_count{labels} {value["count"]}')
+        return samples
+
+
+class Registry:
+    """登记所有指标并按Prometheus文本格式输出"""
+    
+    def __init__(self):
+        self.metrics = []
+    
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+    
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+    
+    def gauge(self, name, help_text, callback):
+        return self.register(Gauge(name, help_text, callback))
+    
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+    
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
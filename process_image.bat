@@ -6,14 +6,16 @@ echo ========================================
 echo.
 
 if "%~1"=="" (
-    echo 使用方法: 将图片拖到此文件上，或
+    echo 使用方法: 将图片或文件夹拖到此文件上（可多个），或
     echo process_image.bat "图片路径"
     echo.
     pause
     exit /b
 )
 
-python image_md5_modifier.py "%~1"
+REM 多个文件只启动一次Python，批处理模式并行处理；单张图片版本数较少时不启动进程池
+REM 常驻进程（python image_md5_daemon.py）运行时交给它处理，省去启动和导入模块的时间
+python image_md5_client.py %* -j 0
 echo.
 pause
 
@@ -0,0 +1,127 @@
+"""
+图片MD5修改工具 - 结果缓存
+相同图片以相同参数再次上传时直接复用之前生成的版本，无需重新计算
+"""
+
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+
+def link_or_copy(src, dst):
+    """优先创建硬链接（不占用额外空间），不支持时复制文件"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ResultCache:
+    """
+    按(原图MD5, 扩展名, 生成参数)索引的磁盘缓存
+
+    每个条目是缓存目录下的一个子目录，保存v01、v02...各版本的硬链接。
+    请求的版本数不超过已缓存的版本数时直接返回前N个版本；总大小超过上限时按LRU淘汰。
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> {'versions': 版本数, 'bytes': 总大小}，按最近使用排序
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(source_md5, file_ext, params):
+        return f"{source_md5}_{file_ext.lstrip('.').lower()}_{params}"
+
+    def _load(self):
+        """启动时从缓存目录恢复索引，按修改时间还原LRU顺序"""
+        dirs = [entry for entry in os.scandir(self.cache_dir) if entry.is_dir()]
+        for entry in sorted(dirs, key=lambda e: e.stat().st_mtime):
+            files = [f for f in os.scandir(entry.path) if f.is_file()]
+            size = sum(f.stat().st_size for f in files)
+            self.entries[entry.name] = {'versions': len(files), 'bytes': size}
+            self.total_bytes += size
+        self._evict()
+
+    def _version_path(self, key, index, file_ext):
+        return os.path.join(self.cache_dir, key, f"v{index + 1:02d}{file_ext.lower()}")
+
+    def lookup(self, key, num_versions, output_dir, base_name, file_ext):
+        """
+        命中时把前num_versions个版本链接到输出目录并返回True，未命中返回False
+
+        缓存文件已被删除（手动清理等）时丢弃该条目和已链接的文件，按未命中处理。
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry['versions'] < num_versions:
+                self.misses += 1
+                return False
+
+            outputs = [os.path.join(output_dir, f"{base_name}_v{i + 1:02d}{file_ext}") for i in range(num_versions)]
+            try:
+                for i, output_path in enumerate(outputs):
+                    link_or_copy(self._version_path(key, i, file_ext), output_path)
+                os.utime(os.path.join(self.cache_dir, key))
+            except OSError:
+                for output_path in outputs:
+                    if os.path.exists(output_path):
+                        os.remove(output_path)
+                self._remove(key)
+                self.misses += 1
+                return False
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def store(self, key, num_versions, output_dir, base_name, file_ext):
+        """把一次完整处理的结果加入缓存（已缓存更多版本时忽略）"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['versions'] >= num_versions:
+                return
+
+            entry_dir = os.path.join(self.cache_dir, key)
+            if entry is not None:
+                self._remove(key)
+            os.makedirs(entry_dir, exist_ok=True)
+            size = 0
+            for i in range(num_versions):
+                version_path = self._version_path(key, i, file_ext)
+                link_or_copy(os.path.join(output_dir, f"{base_name}_v{i + 1:02d}{file_ext}"), version_path)
+                size += os.path.getsize(version_path)
+
+            self.entries[key] = {'versions': num_versions, 'bytes': size}
+            self.total_bytes += size
+            self._evict()
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry['bytes']
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def _evict(self):
+        """总大小超过上限时淘汰最久未使用的条目"""
+        while self.entries and self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,311 @@
+"""
+图片MD5修改工具 - 会话存储
+网页版每个会话的上传文件和生成文件都由会话存储管理，超过有效期或总大小超过上限时自动清理
+"""
+
+import os
+import time
+import hashlib
+import shutil
+import threading
+from collections import OrderedDict
+
+
+class SessionStore:
+    """
+    带有效期和总大小上限的会话存储
+    
+    内存中维护{会话ID: 文件索引}，读写只查索引，不扫描目录；会话按最近访问时间排序。
+    每个文件的MD5（用作下载的ETag）和缩略图也记在会话中，随会话一起删除。
+    后台清理线程定期删除超过有效期（最后一次访问后ttl秒）的会话，总大小超过上限时
+    从最久未访问的会话开始删除。正在处理的会话（acquire后尚未release）不会被删除。
+    子类实现_create、_write、_save_upload和_discard，决定文件保存在磁盘还是内存中。
+    """
+    
+    def __init__(self, max_bytes, ttl, janitor_interval=60, on_evict=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict  # 会话被删除后的回调on_evict(session_id)
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # session_id -> {'files', 'sizes', 'md5s', 'thumbs', 'bytes', 'accessed', 'busy'}
+        self.total_bytes = 0
+        self.expired = 0
+        self.evictions = 0
+        if janitor_interval:
+            self._start_janitor(janitor_interval)
+    
+    def _new_session(self, session_id, size=0, accessed=None, busy=0):
+        self.sessions[session_id] = {
+            'files': OrderedDict(),  # filename -> 文件路径或文件内容
+            'sizes': {},  # filename -> 文件大小
+            'md5s': {},  # filename -> 文件MD5
+            'thumbs': {},  # filename -> 缩略图内容（保存在内存中，计入会话大小）
+            'bytes': size,
+            'accessed': time.time() if accessed is None else accessed,
+            'busy': busy,
+        }
+        self.total_bytes += size
+    
+    def _touch(self, session_id):
+        """查找会话并标记为最近访问，不存在时返回None（调用者持有锁）"""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session['accessed'] = time.time()
+            self.sessions.move_to_end(session_id)
+        return session
+    
+    def _add_bytes(self, session, size):
+        session['bytes'] += size
+        self.total_bytes += size
+    
+    def create(self, session_id):
+        """
+        登记新会话，返回(输出目录, 上传目录)，内存存储返回(None, None)
+        
+        新会话处于处理中状态（相当于已acquire一次），保存上传文件时的清理不会把它删除；
+        上传文件保存完、任务放入队列（或请求失败）后调用release。
+        """
+        with self.lock:
+            self._new_session(session_id, busy=1)
+        return self._create(session_id)
+    
+    def save_upload(self, session_id, filename, file):
+        """保存上传文件，返回传给process_image的图片来源（文件路径或文件内容）"""
+        source, size = self._save_upload(session_id, filename, file)
+        with self.lock:
+            session = self._touch(session_id)
+            if session is not None:
+                self._add_bytes(session, size)
+        self.cleanup()
+        return source
+    
+    def put(self, session_id, filename, data, md5=None):
+        """保存一个生成文件（可直接作为process_image的output_sink），md5为已计算的文件MD5，会话已删除时丢弃"""
+        with self.lock:
+            if session_id not in self.sessions:
+                return
+        self._record(session_id, filename, self._write(session_id, filename, data), len(data), md5)
+        self.cleanup()
+    
+    def _record(self, session_id, filename, entry, size, md5=None):
+        with self.lock:
+            session = self._touch(session_id)
+            if session is None:
+                return
+            self._add_bytes(session, size - session['sizes'].get(filename, 0))
+            session['files'][filename] = entry
+            session['sizes'][filename] = size
+            if md5 is not None:
+                session['md5s'][filename] = md5
+            else:
+                session['md5s'].pop(filename, None)
+    
+    def md5(self, session_id, filename):
+        """返回文件的MD5，保存时未提供的在第一次查询时计算；会话或文件不存在时返回None"""
+        with self.lock:
+            session = self._touch(session_id)
+            if session is None or filename not in session['files']:
+                return None
+            md5 = session['md5s'].get(filename)
+            entry = session['files'][filename]
+        if md5 is None:
+            hash_md5 = hashlib.md5()
+            if isinstance(entry, bytes):
+                hash_md5.update(entry)
+            else:
+                with open(entry, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        hash_md5.update(chunk)
+            md5 = hash_md5.hexdigest()
+            with self.lock:
+                session = self.sessions.get(session_id)
+                if session is not None and session['files'].get(filename) is entry:
+                    session['md5s'][filename] = md5
+        return md5
+    
+    def put_thumbnail(self, session_id, filename, data):
+        """保存文件的缩略图，会话已删除时丢弃"""
+        with self.lock:
+            session = self._touch(session_id)
+            if session is None:
+                return
+            old = session['thumbs'].get(filename)
+            self._add_bytes(session, len(data) - (len(old) if old is not None else 0))
+            session['thumbs'][filename] = data
+        self.cleanup()
+    
+    def get_thumbnail(self, session_id, filename):
+        with self.lock:
+            session = self._touch(session_id)
+            if session is None:
+                return None
+            return session['thumbs'].get(filename)
+    
+    def get(self, session_id, filename):
+        """返回文件路径或文件内容，会话或文件不存在时返回None"""
+        with self.lock:
+            session = self._touch(session_id)
+            if session is None:
+                return None
+            return session['files'].get(filename)
+    
+    def list(self, session_id):
+        """返回会话中的[(文件名, 文件路径或文件内容)]，按文件名排序；会话不存在时返回None"""
+        with self.lock:
+            session = self._touch(session_id)
+            if session is None:
+                return None
+            return sorted(session['files'].items())
+    
+    def acquire(self, session_id):
+        """标记会话正在处理，处理完成前不会被删除"""
+        with self.lock:
+            session = self._touch(session_id)
+            if session is not None:
+                session['busy'] += 1
+    
+    def release(self, session_id):
+        with self.lock:
+            session = self._touch(session_id)
+            if session is not None:
+                session['busy'] -= 1
+    
+    def cleanup(self, now=None):
+        """删除过期的会话，总大小超过上限时删除最久未访问的会话，返回删除的会话数"""
+        now = time.time() if now is None else now
+        victims = []
+        with self.lock:
+            # 会话按最近访问时间排序，从最久未访问的一端开始，遇到第一个既未过期也无需淘汰的会话就停止，
+            # 每次保存文件时调用的开销只与删除的会话数（以及排在前面正在处理的会话数）有关，与会话总数无关
+            remaining = self.total_bytes
+            for session_id, session in self.sessions.items():
+                if session['busy']:
+                    continue
+                if now - session['accessed'] > self.ttl:
+                    self.expired += 1
+                elif remaining > self.max_bytes:
+                    self.evictions += 1
+                else:
+                    break
+                remaining -= session['bytes']
+                victims.append(session_id)
+            for session_id in victims:
+                self.total_bytes -= self.sessions.pop(session_id)['bytes']
+        
+        for session_id in victims:
+            self._discard(session_id)
+            if self.on_evict is not None:
+                self.on_evict(session_id)
+        return len(victims)
+    
+    def _start_janitor(self, interval):
+        def janitor():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.cleanup()
+                except Exception as e:
+                    print(f"会话清理失败: {e}")
+        
+        threading.Thread(target=janitor, name='session-janitor', daemon=True).start()
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'sessions': len(self.sessions),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'expired': self.expired,
+                'evictions': self.evictions,
+            }
+
+
+class DiskSessionStore(SessionStore):
+    """
+    文件保存在outputs/<session_id>和uploads/<session_id>目录中的会话存储
+    
+    启动时扫描一次已有的会话目录，按修改时间恢复索引，之前运行遗留的会话同样会过期清理。
+    """
+    
+    def __init__(self, output_folder, upload_folder, max_bytes, ttl, **kwargs):
+        self.output_folder = os.path.abspath(output_folder)
+        self.upload_folder = os.path.abspath(upload_folder)
+        os.makedirs(self.output_folder, exist_ok=True)
+        os.makedirs(self.upload_folder, exist_ok=True)
+        super().__init__(max_bytes, ttl, **kwargs)
+        self._load()
+    
+    def _dirs(self, session_id):
+        return os.path.join(self.output_folder, session_id), os.path.join(self.upload_folder, session_id)
+    
+    def _load(self):
+        found = {}
+        for folder in (self.output_folder, self.upload_folder):
+            for entry in os.scandir(folder):
+                if not entry.is_dir():
+                    continue
+                files = [f for f in os.scandir(entry.path) if f.is_file()]
+                size = sum(f.stat().st_size for f in files)
+                accessed = max([entry.stat().st_mtime] + [f.stat().st_mtime for f in files])
+                outputs = files if folder == self.output_folder else []
+                old_size, old_accessed, old_outputs = found.get(entry.name, (0, 0, []))
+                found[entry.name] = (old_size + size, max(old_accessed, accessed), old_outputs + outputs)
+        
+        for session_id, (size, accessed, outputs) in sorted(found.items(), key=lambda item: item[1][1]):
+            self._new_session(session_id, size, accessed)
+            for f in sorted(outputs, key=lambda f: f.name):
+                self.sessions[session_id]['files'][f.name] = f.path
+                self.sessions[session_id]['sizes'][f.name] = f.stat().st_size
+    
+    def _create(self, session_id):
+        output_dir, upload_dir = self._dirs(session_id)
+        os.makedirs(output_dir, exist_ok=True)
+        os.makedirs(upload_dir, exist_ok=True)
+        return output_dir, upload_dir
+    
+    def _save_upload(self, session_id, filename, file):
+        upload_path = os.path.join(self._dirs(session_id)[1], filename)
+        file.save(upload_path)
+        return upload_path, os.path.getsize(upload_path)
+    
+    def _write(self, session_id, filename, data):
+        output_path = os.path.join(self._dirs(session_id)[0], filename)
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        return output_path
+    
+    def add(self, session_id, filename):
+        """登记由外部直接放入输出目录的文件（例如结果缓存链接过来的版本）"""
+        output_path = os.path.join(self._dirs(session_id)[0], filename)
+        self._record(session_id, filename, output_path, os.path.getsize(output_path))
+    
+    def _discard(self, session_id):
+        for directory in self._dirs(session_id):
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class MemorySessionStore(SessionStore):
+    """
+    文件只保存在内存中的会话存储，处理和下载都不经过磁盘
+    
+    上传内容默认由处理任务持有，处理完成后即释放，不计入会话大小；
+    keep_uploads为True时（按需生成模式，下载时才生成版本）会话一直持有上传内容，计入会话大小。
+    """
+    
+    def __init__(self, max_bytes, ttl, keep_uploads=False, **kwargs):
+        self.keep_uploads = keep_uploads
+        super().__init__(max_bytes, ttl, **kwargs)
+    
+    def _create(self, session_id):
+        return None, None
+    
+    def _save_upload(self, session_id, filename, file):
+        data = file.read()
+        return data, len(data) if self.keep_uploads else 0
+    
+    def _write(self, session_id, filename, data):
+        return data
+    
+    def _discard(self, session_id):
+        pass